@@ -0,0 +1,118 @@
+"""Handler latency benchmark for the SQLite access layer.
+
+Simulates users arriving at a fixed rate and each sending /start, /register
+and /status against TelegramBot with stubbed Telegram objects. Latency is
+measured from when a command arrives until its handler finishes, so time spent
+waiting behind a blocked event loop is included. Reports per-handler p50/p99
+and the worst event-loop stall. The "inline" mode reproduces
+the old behaviour (a fresh connection per query, run on the event loop) as a
+baseline for the shared Database layer.
+
+Usage: python bench/bench_db.py --users 500 --rate 200 --rounds 3
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import main  # noqa: E402
+from harness import percentile  # noqa: E402
+
+
+class InlineDatabase(main.Database):
+    """Old access pattern: connect, query, commit and close on the event loop thread"""
+
+    async def _run(self, operation, func, *args):
+        conn = sqlite3.connect(self.path)
+        try:
+            return func(conn, *args)
+        finally:
+            conn.close()
+
+
+def make_update(user_id: int):
+    async def reply_text(*args, **kwargs):
+        pass
+    user = SimpleNamespace(id=user_id, username=f"user{user_id}", first_name="User")
+    return SimpleNamespace(effective_user=user, message=SimpleNamespace(reply_text=reply_text))
+
+
+def make_context(args: list):
+    async def get_chat_member(chat_id, user_id):
+        return SimpleNamespace(status='member')
+    return SimpleNamespace(args=args, bot=SimpleNamespace(get_chat_member=get_chat_member))
+
+
+async def simulate_user(bot, user_id: int, arrival: float, rounds: int, latencies: dict):
+    await asyncio.sleep(max(0.0, arrival - time.perf_counter()))
+    update = make_update(user_id)
+    sent_at = arrival
+    for i in range(rounds):
+        wallet = '0x%040x' % (user_id * 1000 + i)
+        for name, handler, context in (
+            ('start', bot.start_command, make_context([])),
+            ('register', bot.register_command, make_context([wallet])),
+            ('status', bot.status_command, make_context([])),
+        ):
+            await handler(update, context)
+            # The next command is sent once the previous reply arrives
+            done = time.perf_counter()
+            latencies[name].append(done - sent_at)
+            sent_at = done
+
+
+async def watch_loop_lag(stop: asyncio.Event, lags: list):
+    interval = 0.001
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - started - interval)
+
+
+async def run_mode(mode: str, users: int, rate: float, rounds: int, directory: str):
+    bot = main.TelegramBot()
+    path = os.path.join(directory, f'{mode}.db')
+    bot.db = InlineDatabase(path) if mode == 'inline' else main.Database(path)
+    await bot.db.init_schema()
+
+    latencies = {'start': [], 'register': [], 'status': []}
+    lags = []
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(watch_loop_lag(stop, lags))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        simulate_user(bot, user_id, started + user_id / rate, rounds, latencies)
+        for user_id in range(1, users + 1)
+    ))
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await watcher
+    await bot.db.close()
+
+    print(f"\n[{mode}] {users} users at {rate:g}/s x {rounds} rounds in {elapsed:.2f}s")
+    for name, samples in latencies.items():
+        print(f"  /{name:<9} p50 {percentile(samples, 50) * 1000:8.2f} ms   p99 {percentile(samples, 99) * 1000:8.2f} ms")
+    print(f"  loop stall max {max(lags, default=0) * 1000:.2f} ms")
+
+
+async def main_async(args):
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in args.modes:
+            await run_mode(mode, args.users, args.rate, args.rounds, directory)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--rate', type=float, default=100.0, help='new users per second')
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--modes', nargs='+', default=['inline', 'shared'], choices=['inline', 'shared'])
+    asyncio.run(main_async(parser.parse_args()))
@@ -0,0 +1,107 @@
+"""Block decoding benchmark: web3 get_block vs. the raw JSON-RPC fast path.
+
+Both paths start from the same raw eth_getBlockByNumber response bytes, so
+JSON parsing is included on each side:
+
+- web3: AsyncWeb3.eth.get_block(full_transactions=True) through the middleware
+  onion (with ExtraDataToPOAMiddleware) and result formatters, followed by
+  the matching loop the bot used on AttributeDict transactions.
+- raw:  json decode + decode_block_transactions + PharosMonitor.match_block.
+
+web3 is only needed here: pip install -r bench/requirements.txt
+
+Usage: python bench/bench_decode.py --txs 100 1000 5000 --match-ratio 0.01
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from web3 import AsyncWeb3, Web3  # noqa: E402
+from web3.providers.async_base import AsyncJSONBaseProvider  # noqa: E402
+
+import main  # noqa: E402
+from harness import address, synthetic_block  # noqa: E402
+
+
+class CannedProvider(AsyncJSONBaseProvider):
+    """Provider that answers every request with the same raw response bytes"""
+
+    def __init__(self, raw: bytes):
+        super().__init__()
+        self.raw = raw
+
+    async def make_request(self, method, params):
+        return self.decode_rpc_response(self.raw)
+
+    async def is_connected(self, show_traceback: bool = False) -> bool:
+        return True
+
+
+def legacy_match(index, block_number: int, block) -> list:
+    """Matching loop as it ran on web3-formatted blocks"""
+    found = []
+    for tx in block.transactions:
+        from_users = index.get(tx['from'])
+        to_users = index.get(tx['to'])
+        if not from_users and not to_users:
+            continue
+        found.append({
+            'tx_hash': tx['hash'].hex(), 'from': tx['from'], 'to': tx['to'],
+            'value': Web3.from_wei(tx['value'], 'ether'), 'block_number': block_number, 'gas_used': tx['gas'],
+            'user_id': (from_users or to_users)[0],
+        })
+    return found
+
+
+async def timed(func, rounds: int) -> float:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        await func()
+    return (time.perf_counter() - started) / rounds
+
+
+async def main_async(args):
+    monitor = main.PharosMonitor()
+    watched = [address(0x300000 + i) for i in range(args.addresses)]
+    for user_id, wallet in enumerate(watched, 1):
+        monitor.monitored_addresses.add(wallet, user_id)
+
+    print(f"{'txs/block':>10} {'web3 ms':>10} {'raw ms':>10} {'speedup':>8}  matches")
+    for tx_count in args.txs:
+        block = synthetic_block(1000, tx_count, args.match_ratio, watched)
+        raw = json.dumps({"jsonrpc": "2.0", "id": 0, "result": block}).encode()
+
+        w3 = AsyncWeb3(CannedProvider(raw))
+        try:
+            from web3.middleware import ExtraDataToPOAMiddleware
+            w3.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
+        except ImportError:
+            pass
+
+        async def web3_path():
+            formatted = await w3.eth.get_block(1000, full_transactions=True)
+            return legacy_match(monitor.monitored_addresses, 1000, formatted)
+
+        async def raw_path():
+            result = main.json_loads(raw)['result']
+            return monitor.match_block(1000, main.decode_block_transactions(result))
+
+        assert len(await web3_path()) == len(await raw_path())
+        rounds = max(3, 20000 // tx_count)
+        web3_time = await timed(web3_path, rounds)
+        raw_time = await timed(raw_path, rounds)
+        print(f"{tx_count:>10} {web3_time * 1000:>10.2f} {raw_time * 1000:>10.2f} "
+              f"{web3_time / raw_time:>7.1f}x  {len(await raw_path())}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--txs', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--match-ratio', type=float, default=0.01)
+    parser.add_argument('--addresses', type=int, default=1000, help='monitored addresses')
+    asyncio.run(main_async(parser.parse_args()))
@@ -0,0 +1,176 @@
+"""End-to-end monitor benchmark against a fake node and a fake Telegram API.
+
+For each address count, registers that many users in a fresh database and
+runs the real TelegramBot.monitor_transactions loop and NotificationDispatcher:
+
+1. catch-up: the node starts --backlog blocks ahead of the cursor; reports
+   scan throughput in blocks/s until the cursor reaches head.
+2. live: the node produces --live-blocks more blocks every --block-time
+   seconds; reports latency from block production to the sendMessage call
+   arriving at the fake Telegram API (p50/p95/p99), which includes head
+   detection, fetching, matching, the digest window and rate limiting.
+
+Memory is reported as the size of the address index (traced with
+tracemalloc while loading) and the process RSS after loading. Sizes run one
+after another in one process, so use a single --addresses value per run
+for exact RSS numbers.
+
+Usage: python bench/bench_monitor.py --addresses 1000 10000 100000 --push
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from telegram.ext import Application  # noqa: E402
+
+import main  # noqa: E402
+from harness import (  # noqa: E402
+    FakeChain, FakeRPCNode, FakeTelegramAPI, address, blocks_in_message, percentile, rss_mb,
+)
+
+FIRST_BLOCK = 1000
+
+
+async def wait_until(condition, timeout: float) -> bool:
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            return False
+        await asyncio.sleep(0.005)
+    return True
+
+
+async def run_case(count: int, args, telegram: FakeTelegramAPI, directory: str) -> dict:
+    watched = [address(0x300000 + i) for i in range(count)]
+    chain = FakeChain(FIRST_BLOCK + args.backlog - 1, args.txs, args.match_ratio, watched)
+    node = FakeRPCNode(chain, latency=args.rpc_latency / 1000)
+    await node.start()
+    main.RPC_URLS = [node.url]
+    main.WS_URL = node.ws_url if args.push else None
+    main.BLOCK_CACHE_PATH = os.path.join(directory, f'blocks_{count}.db')
+
+    bot = main.TelegramBot()
+    bot.db = main.Database(os.path.join(directory, f'bench_{count}.db'))
+    bot.tracked_buffer = main.TrackedTransactionBuffer(bot.db)
+    await bot.db.init_schema()
+
+    def register(conn):
+        conn.executemany(
+            'INSERT INTO users (user_id, username, is_group_member) VALUES (?, ?, 1)',
+            [(user_id, f'user{user_id}') for user_id in range(1, count + 1)]
+        )
+        conn.executemany(
+            'INSERT INTO subscriptions (user_id, address) VALUES (?, ?)',
+            [(user_id, main.address_key(wallet)) for user_id, wallet in enumerate(watched, 1)]
+        )
+    await bot.db.transaction('register', register)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    await bot.load_monitored_addresses()
+    load_time = time.perf_counter() - started
+    index_size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    rss_after = rss_mb()
+
+    bot.application = Application.builder().token('1:bench').base_url(telegram.base_url).build()
+    await bot.application.initialize()
+    bot.dispatcher.start()
+    monitor = bot.pharos_monitor
+    await monitor.connect()
+    monitor.start_head_subscription()
+    monitor.last_checked_block = FIRST_BLOCK - 1
+    telegram.messages.clear()
+
+    # Catch-up throughput
+    started = time.perf_counter()
+    task = asyncio.create_task(bot.monitor_transactions())
+    await wait_until(lambda: monitor.last_checked_block >= chain.head, args.timeout)
+    catchup_time = time.perf_counter() - started
+    await wait_until(lambda: bot.dispatcher.queue_depth() == 0, args.timeout)
+
+    # Live latency
+    live_from = chain.head
+    for _ in range(args.live_blocks):
+        chain.advance()
+        await asyncio.sleep(args.block_time)
+    await wait_until(lambda: monitor.last_checked_block >= chain.head, args.timeout)
+    await wait_until(lambda: bot.dispatcher.queue_depth() == 0, args.timeout)
+    await asyncio.sleep(main.DIGEST_WINDOW + 0.5)  # let the last digests go out
+
+    latencies = [
+        sent_at - chain.produced_at[block]
+        for _, text, sent_at in telegram.messages
+        for block in blocks_in_message(text)
+        if block > live_from
+    ]
+
+    task.cancel()
+    await bot.dispatcher.stop()
+    await bot.application.shutdown()
+    await monitor.close()
+    await bot.db.close()
+    await node.stop()
+
+    return {
+        'addresses': count,
+        'load_ms': load_time * 1000,
+        'index_mb': index_size / 2 ** 20,
+        'rss_mb': rss_after,
+        'blocks_per_s': args.backlog / catchup_time,
+        'latencies': latencies,
+        'messages': len(telegram.messages),
+    }
+
+
+async def main_async(args):
+    main.DIGEST_WINDOW = args.digest_window
+    main.NOTIFY_GLOBAL_RATE = args.notify_rate
+    main.POLL_INTERVAL = args.poll_interval
+
+    telegram = FakeTelegramAPI()
+    await telegram.start()
+    mode = 'push' if args.push else f'adaptive polling from {args.poll_interval:g}s'
+    print(f"{args.txs} txs/block, match ratio {args.match_ratio:g}, {args.backlog} backlog blocks, "
+          f"{args.live_blocks} live blocks every {args.block_time:g}s, {mode}, RPC latency {args.rpc_latency:g} ms")
+    print(f"{'addresses':>10} {'load ms':>9} {'index MB':>9} {'RSS MB':>8} {'blocks/s':>9} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'msgs':>6}")
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            for count in args.addresses:
+                result = await run_case(count, args, telegram, directory)
+                latencies = result['latencies'] or [float('nan')]
+                print(f"{result['addresses']:>10} {result['load_ms']:>9.1f} {result['index_mb']:>9.1f} "
+                      f"{result['rss_mb']:>8.1f} {result['blocks_per_s']:>9.1f} "
+                      f"{percentile(latencies, 50) * 1000:>8.1f} {percentile(latencies, 95) * 1000:>8.1f} "
+                      f"{percentile(latencies, 99) * 1000:>8.1f} {result['messages']:>6}")
+    finally:
+        await telegram.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--addresses', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--txs', type=int, default=200, help='transactions per block')
+    parser.add_argument('--match-ratio', type=float, default=0.01)
+    parser.add_argument('--backlog', type=int, default=2000, help='blocks behind head at start')
+    parser.add_argument('--live-blocks', type=int, default=20)
+    parser.add_argument('--block-time', type=float, default=0.5, help='seconds between live blocks')
+    parser.add_argument('--push', action='store_true', help='use eth_subscribe("newHeads") instead of polling')
+    parser.add_argument('--poll-interval', type=float, default=main.POLL_INTERVAL,
+                        help='head poll interval until the block time is measured')
+    parser.add_argument('--rpc-latency', type=float, default=0.0, help='added delay per RPC request, ms')
+    parser.add_argument('--digest-window', type=float, default=main.DIGEST_WINDOW)
+    parser.add_argument('--notify-rate', type=float, default=1000.0,
+                        help='global messages/s; the fake API has no flood limit, so the catch-up burst drains quickly')
+    parser.add_argument('--timeout', type=float, default=300.0)
+    args = parser.parse_args()
+    logging.getLogger('main').setLevel(logging.WARNING)
+    asyncio.run(main_async(args))
@@ -0,0 +1,125 @@
+"""RPC pool benchmark: hedging and failover across several fake nodes.
+
+Runs PharosMonitor.get_blocks against two FakeRPCNodes, each fetch asking
+for --batch new blocks so the block cache never answers:
+
+1. hedging: node A answers eth_blockNumber health probes quickly but takes
+   --slow-batch seconds per block batch; node B takes --rpc-latency ms for
+   everything. Reports fetch latency, hedged fetches and the node ranked
+   first afterwards. Once A has lost a hedge it should rank behind B, so
+   later fetches no longer wait RPC_HEDGE_AFTER.
+2. failover: both nodes are equally fast; the node ranked first goes down
+   (HTTP 503) after a third of the fetches and comes back after two thirds.
+   Reports fetch latency, failed fetches and requests served per node.
+
+Health probes run every --health-interval seconds throughout.
+
+Usage: python bench/bench_pool.py --fetches 30 --slow-batch 1.0
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import main  # noqa: E402
+from harness import FakeChain, FakeRPCNode, percentile  # noqa: E402
+
+
+async def fetch_all(monitor: main.PharosMonitor, chain: FakeChain, args, on_fetch=None) -> tuple:
+    """Fetch --fetches batches of unseen blocks, returning (latencies, failures)"""
+    latencies, failures = [], 0
+    first = 1
+    for i in range(args.fetches):
+        if on_fetch is not None:
+            on_fetch(i)
+        numbers = list(range(first, first + args.batch))
+        first += args.batch
+        started = time.perf_counter()
+        try:
+            await monitor.get_blocks(numbers)
+            latencies.append(time.perf_counter() - started)
+        except Exception:
+            failures += 1
+        await asyncio.sleep(args.interval)
+    return latencies, failures
+
+
+async def run_case(name: str, nodes: list, chain: FakeChain, args, on_fetch=None):
+    main.RPC_URLS = [node.url for node in nodes]
+    monitor = main.PharosMonitor()
+    await monitor.connect()
+    monitor.start_health_checks()
+    hedges_before = main.RPC_HEDGES.values.get((), 0)
+    requests_before = [node.requests for node in nodes]
+
+    latencies, failures = await fetch_all(monitor, chain, args, on_fetch)
+
+    labels = {node.url: label for node, label in zip(nodes, 'AB')}
+    ranked = monitor.pool.ranked()
+    await monitor.close()
+
+    latencies = latencies or [float('nan')]
+    served = ' '.join(f"{label}={node.requests - before}" for node, label, before in zip(nodes, 'AB', requests_before))
+    print(f"{name:>9} {percentile(latencies, 50) * 1000:>8.1f} {percentile(latencies, 95) * 1000:>8.1f} "
+          f"{max(latencies) * 1000:>8.1f} {main.RPC_HEDGES.values.get((), 0) - hedges_before:>7} {failures:>7} "
+          f"{labels[ranked[0].url]:>6}   {served}")
+
+
+async def main_async(args):
+    main.BLOCK_CACHE_PATH = ''
+    main.RPC_HEALTH_INTERVAL = args.health_interval
+    main.RPC_HEDGE_AFTER = args.hedge_after
+    chain = FakeChain(args.fetches * args.batch + 10, args.txs, 0.0, [])
+    latency = args.rpc_latency / 1000
+
+    print(f"{args.fetches} fetches of {args.batch} blocks ({args.txs} txs each), hedge after {args.hedge_after:g}s, "
+          f"node latency {args.rpc_latency:g} ms, health probes every {args.health_interval:g}s")
+    print(f"{'case':>9} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'hedged':>7} {'failed':>7} {'first':>6}   requests")
+
+    # Slow on batches, fast on probes
+    nodes = [FakeRPCNode(chain, latency=latency, batch_latency=args.slow_batch), FakeRPCNode(chain, latency=latency)]
+    for node in nodes:
+        await node.start()
+    try:
+        await run_case('hedging', nodes, chain, args)
+    finally:
+        for node in nodes:
+            await node.stop()
+
+    # The preferred node fails for the middle third of the run
+    nodes = [FakeRPCNode(chain, latency=latency), FakeRPCNode(chain, latency=latency)]
+    for node in nodes:
+        await node.start()
+
+    def toggle(i: int):
+        if i == args.fetches // 3:
+            nodes[0].down = True
+        elif i == 2 * args.fetches // 3:
+            nodes[0].down = False
+
+    try:
+        # Make A the preferred node before it fails
+        nodes[1].latency = nodes[1].batch_latency = latency + 0.005
+        await run_case('failover', nodes, chain, args, toggle)
+    finally:
+        for node in nodes:
+            await node.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--fetches', type=int, default=30)
+    parser.add_argument('--batch', type=int, default=10, help='blocks per fetch')
+    parser.add_argument('--txs', type=int, default=50, help='transactions per block')
+    parser.add_argument('--slow-batch', type=float, default=1.0, help='seconds node A takes per batch in the hedging case')
+    parser.add_argument('--rpc-latency', type=float, default=5.0, help='delay per request of a healthy node, ms')
+    parser.add_argument('--hedge-after', type=float, default=main.RPC_HEDGE_AFTER)
+    parser.add_argument('--health-interval', type=float, default=1.0)
+    parser.add_argument('--interval', type=float, default=0.1, help='seconds between fetches')
+    args = parser.parse_args()
+    logging.getLogger('main').setLevel(logging.ERROR)
+    asyncio.run(main_async(args))
@@ -0,0 +1,119 @@
+"""Cold start benchmark: time from process spawn to the first scanned block.
+
+Each run starts a fresh interpreter that imports main and calls
+TelegramBot.run() against a fake node and a fake Telegram API, with a
+database of --addresses subscriptions and a saved cursor one block behind
+head. The child reports when `import main` finished and when the first block
+was scanned (pharos_blocks_scanned_total > 0); the parent reports the median
+over --runs runs, measured from spawning the process.
+
+Usage: python bench/bench_startup.py --addresses 1000 100000 --runs 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+async def child():
+    """Runs in the spawned process: start the bot and report milestones as wall-clock times"""
+    import main
+    imported = time.time()
+
+    task = asyncio.create_task(main.TelegramBot().run())
+    while not main.BLOCKS_SCANNED.values.get((), 0):
+        if task.done():
+            task.result()  # surface the startup error
+            raise SystemExit("bot stopped before scanning")
+        await asyncio.sleep(0.001)
+    print(json.dumps({'imported': imported, 'first_scan': time.time()}), flush=True)
+    await asyncio.Event().wait()  # the parent terminates this process
+
+
+async def prepare_database(path: str, count: int, head: int):
+    import main
+    from harness import address
+    db = main.Database(path)
+    await db.init_schema()
+
+    def register(conn):
+        conn.executemany(
+            'INSERT INTO users (user_id, username, is_group_member) VALUES (?, ?, 1)',
+            [(user_id, f'user{user_id}') for user_id in range(1, count + 1)]
+        )
+        conn.executemany(
+            'INSERT INTO subscriptions (user_id, address) VALUES (?, ?)',
+            [(user_id, main.address_key(address(0x300000 + user_id))) for user_id in range(1, count + 1)]
+        )
+        conn.execute("INSERT OR REPLACE INTO scan_state (key, value) VALUES ('last_checked_block', ?)", (head - 1,))
+    await db.transaction('register', register)
+    await db.close()
+
+
+async def run_once(env: dict, directory: str, timeout: float) -> dict:
+    spawned = time.time()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.abspath(__file__), '--child',
+        env=env, cwd=directory, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+    )
+    try:
+        line = await asyncio.wait_for(process.stdout.readline(), timeout)
+    finally:
+        if process.returncode is None:
+            process.terminate()
+        await process.wait()
+    if not line:
+        raise RuntimeError("child exited without reporting a scan")
+    times = json.loads(line)
+    return {'import_s': times['imported'] - spawned, 'first_scan_s': times['first_scan'] - spawned}
+
+
+async def main_async(args):
+    from harness import FakeChain, FakeRPCNode, FakeTelegramAPI
+
+    chain = FakeChain(100000, args.txs, 0.0, [])
+    node = FakeRPCNode(chain)
+    telegram = FakeTelegramAPI()
+    await node.start()
+    await telegram.start()
+
+    print(f"{args.runs} runs per size, {args.txs} txs/block, median seconds from process spawn")
+    print(f"{'addresses':>10} {'import':>8} {'first scan':>11}")
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            for count in args.addresses:
+                db_path = os.path.join(directory, f'startup_{count}.db')
+                await prepare_database(db_path, count, chain.head)
+                env = dict(
+                    os.environ, BOT_TOKEN='1:bench', GROUP_CHAT_ID='-1', BOT_ROLE='all', DB_PATH=db_path,
+                    RPC_URLS=node.url, BLOCK_CACHE_PATH='', TELEGRAM_API_URL=telegram.base_url,
+                )
+                env.pop('WS_URL', None)
+                env.pop('WEBHOOK_URL', None)
+
+                results = []
+                for _ in range(args.runs):
+                    chain.advance()  # one new block past the saved cursor for every run
+                    results.append(await run_once(env, directory, args.timeout))
+                print(f"{count:>10} {statistics.median(r['import_s'] for r in results):>8.3f} "
+                      f"{statistics.median(r['first_scan_s'] for r in results):>11.3f}")
+    finally:
+        await telegram.stop()
+        await node.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--addresses', type=int, nargs='+', default=[1000, 100000])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--txs', type=int, default=200, help='transactions per block')
+    parser.add_argument('--timeout', type=float, default=60.0, help='seconds to wait for the first scan')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    asyncio.run(child() if args.child else main_async(args))
@@ -0,0 +1,278 @@
+"""Shared offline benchmark harness.
+
+- synthetic_block: raw eth_getBlockByNumber JSON with a configurable number of
+  transactions and share of them touching watched addresses. Transaction
+  values encode the block number (in millionths of PHRS), so a notification
+  text can be traced back to the block it came from.
+- FakeChain: a deterministic chain whose head is advanced by the benchmark.
+- FakeRPCNode: local JSON-RPC server (single and batch requests, block and
+  transaction receipts, plus eth_subscribe("newHeads") on /ws) serving a FakeChain.
+  Delays can differ for single and batch requests, and a node can be taken
+  down to answer HTTP 503, for RPC pool failover and hedging runs.
+- FakeTelegramAPI: local Bot API stand-in that records every sendMessage, for
+  use with Application.builder().base_url(...).
+
+Everything binds to 127.0.0.1 on a free port.
+"""
+import asyncio
+import json
+import os
+import re
+import sys
+import time
+from typing import Dict, Optional
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import main  # noqa: E402
+
+
+def address(i: int) -> str:
+    return '0x%040x' % i
+
+
+def percentile(samples: list, pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def rss_mb() -> float:
+    """Current resident set size in MB (peak RSS where /proc is not available)"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def synthetic_block(number: int, tx_count: int, match_ratio: float, watched: list) -> dict:
+    """Raw block JSON with tx_count transfers, match_ratio of them sent by a watched address"""
+    every = int(1 / match_ratio) if match_ratio > 0 else 0
+    transactions = []
+    for i in range(tx_count):
+        serial = number * tx_count + i
+        sender = watched[serial // every % len(watched)] if every and i % every == 0 else address(0x100000 + serial)
+        transactions.append({
+            "blockHash": "0x%064x" % number, "blockNumber": hex(number), "chainId": hex(main.CHAIN_ID),
+            "from": sender, "gas": "0x5208", "gasPrice": "0x3b9aca00", "hash": "0x%064x" % serial,
+            "input": "0x", "nonce": hex(i), "to": address(0x200000 + i), "transactionIndex": hex(i),
+            "value": hex(number * 10 ** 12 + i), "type": "0x0", "v": "0x1b", "r": "0x" + "01" * 32, "s": "0x" + "02" * 32,
+        })
+    return {
+        "number": hex(number), "hash": "0x%064x" % number, "parentHash": "0x%064x" % (number - 1),
+        "nonce": "0x0000000000000000", "sha3Uncles": "0x" + "00" * 32, "logsBloom": "0x" + "00" * 256,
+        "transactionsRoot": "0x" + "00" * 32, "stateRoot": "0x" + "00" * 32, "receiptsRoot": "0x" + "00" * 32,
+        "miner": address(1), "difficulty": "0x0", "totalDifficulty": "0x0", "extraData": "0x" + "00" * 97,
+        "size": hex(tx_count * 120), "gasLimit": "0x1c9c380", "gasUsed": hex(21000 * tx_count),
+        "timestamp": hex(1700000000 + number), "transactions": transactions, "uncles": [],
+    }
+
+
+AMOUNT_PATTERN = re.compile(r'(\d+\.\d{6}) PHRS')
+
+
+def blocks_in_message(text: str) -> list:
+    """Block numbers of the synthetic transactions listed in a notification text"""
+    return [round(float(amount) * 10 ** 6) for amount in AMOUNT_PATTERN.findall(text)]
+
+
+class FakeChain:
+    """Chain of synthetic blocks; blocks are generated and serialized on first request"""
+
+    def __init__(self, head: int, tx_count: int, match_ratio: float, watched: list, cache_size: int = 512):
+        self.head = head
+        self.tx_count = tx_count
+        self.match_ratio = match_ratio
+        self.watched = watched
+        self.produced_at: Dict[int, float] = {}  # block number -> perf_counter() when it became head
+        self._cache: Dict[int, str] = {}
+        self._cache_size = cache_size
+        self._listeners: list = []
+
+    def block_json(self, number: int) -> str:
+        if number > self.head or number < 0:
+            return 'null'
+        raw = self._cache.get(number)
+        if raw is None:
+            if len(self._cache) >= self._cache_size:
+                del self._cache[next(iter(self._cache))]
+            raw = self._cache[number] = json.dumps(
+                synthetic_block(number, self.tx_count, self.match_ratio, self.watched), separators=(',', ':')
+            )
+        return raw
+
+    def receipt(self, serial: int) -> dict:
+        """Receipt of the transaction with the given serial (block number * tx_count + index)"""
+        number = serial // self.tx_count
+        return {
+            "transactionHash": "0x%064x" % serial, "blockNumber": hex(number), "blockHash": "0x%064x" % number,
+            "transactionIndex": hex(serial % self.tx_count), "gasUsed": "0x5208", "cumulativeGasUsed": "0x5208",
+            "effectiveGasPrice": "0x3b9aca00", "status": "0x1", "logs": [], "type": "0x0",
+        }
+
+    def advance(self, count: int = 1):
+        """Produce new blocks at the head and notify subscribers"""
+        for _ in range(count):
+            self.head += 1
+            self.produced_at[self.head] = time.perf_counter()
+        for queue in self._listeners:
+            queue.put_nowait(self.head)
+
+
+class LocalServer:
+    """aiohttp app bound to a free port on 127.0.0.1"""
+
+    def __init__(self, app: web.Application):
+        self._runner = web.AppRunner(app, access_log=None)
+        self.port = 0
+
+    async def start(self):
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+
+class FakeRPCNode(LocalServer):
+    """JSON-RPC stand-in for the Pharos node, with an optional per-request delay"""
+
+    def __init__(self, chain: FakeChain, latency: float = 0.0, batch_latency: Optional[float] = None):
+        app = web.Application(client_max_size=2 ** 24)
+        app.router.add_post('/', self.handle)
+        app.router.add_get('/ws', self.websocket)
+        super().__init__(app)
+        self.chain = chain
+        self.latency = latency
+        self.batch_latency = latency if batch_latency is None else batch_latency  # delay of batch requests
+        self.down = False  # answer every request with HTTP 503
+        self.requests = 0
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.port}/'
+
+    @property
+    def ws_url(self) -> str:
+        return f'ws://127.0.0.1:{self.port}/ws'
+
+    def _result(self, method: str, params: list) -> Optional[str]:
+        if method == 'eth_blockNumber':
+            return json.dumps(hex(self.chain.head))
+        if method == 'eth_getBlockByNumber':
+            tag = params[0]
+            return self.chain.block_json(self.chain.head if tag == 'latest' else int(tag, 16))
+        if method == 'eth_getTransactionReceipt':
+            serial = int(params[0], 16)
+            return json.dumps(self.chain.receipt(serial) if serial // self.chain.tx_count <= self.chain.head else None)
+        if method == 'eth_getBlockReceipts':
+            number = int(params[0], 16)
+            if number > self.chain.head:
+                return 'null'
+            first = number * self.chain.tx_count
+            return json.dumps([self.chain.receipt(serial) for serial in range(first, first + self.chain.tx_count)])
+        if method == 'eth_chainId':
+            return json.dumps(hex(main.CHAIN_ID))
+        if method == 'web3_clientVersion':
+            return '"fake-node/1.0"'
+        if method == 'eth_getLogs':
+            return '[]'
+        if method == 'eth_call':
+            return '"0x"'
+        return None
+
+    def _reply(self, call: dict) -> str:
+        request_id = json.dumps(call.get('id'))
+        result = self._result(call.get('method'), call.get('params') or [])
+        if result is None:
+            return '{"jsonrpc":"2.0","id":%s,"error":{"code":-32601,"message":"method not found"}}' % request_id
+        # Block JSON is cached pre-serialized, so replies are assembled as text
+        return '{"jsonrpc":"2.0","id":%s,"result":%s}' % (request_id, result)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        payload = await request.json()
+        if self.down:
+            return web.Response(status=503)
+        delay = self.batch_latency if isinstance(payload, list) else self.latency
+        if delay:
+            await asyncio.sleep(delay)
+        if isinstance(payload, list):
+            body = '[' + ','.join(self._reply(call) for call in payload) + ']'
+        else:
+            body = self._reply(payload)
+        return web.Response(text=body, content_type='application/json')
+
+    async def websocket(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        message = await ws.receive_json()
+        await ws.send_json({"jsonrpc": "2.0", "id": message.get('id'), "result": "0xbench"})
+
+        heads: asyncio.Queue = asyncio.Queue()
+        self.chain._listeners.append(heads)
+        try:
+            while not ws.closed:
+                head = await heads.get()
+                if head is None:
+                    break
+                await ws.send_json({
+                    "jsonrpc": "2.0", "method": "eth_subscription",
+                    "params": {"subscription": "0xbench", "result": {"number": hex(head)}},
+                })
+        finally:
+            self.chain._listeners.remove(heads)
+        await ws.close()
+        return ws
+
+    async def stop(self):
+        for heads in self.chain._listeners:
+            heads.put_nowait(None)  # end open subscriptions first
+        await super().stop()
+
+
+class FakeTelegramAPI(LocalServer):
+    """Bot API stand-in recording (chat_id, text, perf_counter()) for every sendMessage"""
+
+    def __init__(self):
+        app = web.Application()
+        app.router.add_route('*', '/bot{token}/{method}', self.handle)
+        super().__init__(app)
+        self.messages: list = []
+        self._message_id = 0
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self.port}/bot'
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+
+        if method == 'getMe':
+            result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif method in ('sendMessage', 'editMessageText'):
+            chat_id = int(params.get('chat_id', 0))
+            self.messages.append((chat_id, params.get('text', ''), time.perf_counter()))
+            self._message_id += 1
+            result = {
+                "message_id": int(params.get('message_id') or self._message_id), "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, "text": params.get('text', ''),
+            }
+        elif method == 'getChatMember':
+            result = {"status": "member", "user": {"id": int(params.get('user_id', 0)), "is_bot": False, "first_name": "User"}}
+        elif method == 'getUpdates':
+            await asyncio.sleep(min(float(params.get('timeout') or 0), 1.0))
+            result = []
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
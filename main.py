@@ -1,41 +1,122 @@
 
 import asyncio
-from flask import Flask
+import atexit
 from threading import Thread
 
-# Simple web server to keep Replit alive
-app = Flask('')
-
-@app.route('/')
-def home():
-    return "Pharos Bot is running!"
-
+# Simple web server to keep Replit alive (Flask is imported in this thread, off the startup path)
 def run_web():
-    app.run(host='0.0.0.0', port=8080)
+    from flask import Flask, Response
+    app = Flask('')
+    
+    @app.route('/')
+    def home():
+        return "Pharos Bot is running!"
+    
+    @app.route('/metrics')
+    def metrics():
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+    
+    @app.route('/healthz')
+    def healthz():
+        text, status = health_status()
+        return text, status
+    
+    app.run(host='0.0.0.0', port=WEB_PORT)
 
-# Jalankan server web di thread terpisah
-Thread(target=run_web).start()
+import hmac
 import json
 import logging
+import logging.handlers
+import queue
 import sqlite3
 import os
+import random
+import secrets
+import socket
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
+import time
 from datetime import datetime
+from decimal import Decimal
 from typing import Dict, Set, Optional
 import aiohttp
+from aiohttp import web
+try:
+    # Optional faster JSON decoding for large raw block responses
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
-import web3
-from web3 import Web3
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler, ChatMemberHandler
+from telegram.error import BadRequest, RetryAfter, TimedOut, NetworkError, Forbidden
 
 # Configure logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO,
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('bot.log', encoding='utf-8')
-    ]
-)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FILE = os.getenv("LOG_FILE", "bot.log")  # empty logs to the console only
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 2 ** 20)))  # size at which bot.log is rotated
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", "5"))  # rotated files kept, bot.log.1 ... bot.log.5
+LOG_RATE_INTERVAL = float(os.getenv("LOG_RATE_INTERVAL", "10"))  # seconds per rate limit window
+LOG_RATE_BURST = int(os.getenv("LOG_RATE_BURST", "5"))  # records per message template and window
+
+class RateLimitFilter(logging.Filter):
+    """Let through at most LOG_RATE_BURST records per message template every LOG_RATE_INTERVAL seconds.
+    
+    Records are grouped by their unformatted %-style template, so a message
+    repeated for every block or every retry counts as one kind. The first
+    record after a window with drops reports how many were suppressed.
+    """
+    
+    def __init__(self):
+        super().__init__()
+        self._windows: Dict[tuple, list] = {}  # (logger, level, template) -> [window start, passed, dropped]
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.name, record.levelno, record.msg)
+        now = record.created
+        window = self._windows.get(key)
+        if window is None or now - window[0] >= LOG_RATE_INTERVAL:
+            dropped = window[2] if window is not None else 0
+            if len(self._windows) > 10000:
+                self._windows.clear()  # templates are a small fixed set; only guard against unbounded keys
+            self._windows[key] = [now, 1, 0]
+            if dropped and isinstance(record.msg, str):
+                record.msg = f"{record.msg} ({dropped} similar messages suppressed)"
+            return True
+        if window[1] < LOG_RATE_BURST:
+            window[1] += 1
+            return True
+        window[2] += 1
+        return False
+
+def setup_logging() -> logging.handlers.QueueListener:
+    """Route all records through a queue to a listener thread that does the console and file I/O.
+    
+    The event loop only formats a record and puts it on the queue; rotation
+    and disk writes never block it.
+    """
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    handlers = [logging.StreamHandler()]
+    if LOG_FILE:
+        handlers.append(logging.handlers.RotatingFileHandler(
+            LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding='utf-8'
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))  # the listener's handlers add the prefix
+    queue_handler.addFilter(RateLimitFilter())
+    logging.basicConfig(level=LOG_LEVEL, handlers=[queue_handler])
+    
+    listener = logging.handlers.QueueListener(log_queue, *handlers)
+    listener.start()
+    atexit.register(listener.stop)  # drain what is still queued on exit
+    return listener
+
+log_listener = setup_logging()
 logger = logging.getLogger(__name__)
 
 # Reduce noisy logging from some libraries
@@ -48,102 +129,2283 @@ GROUP_CHAT_ID = os.getenv("GROUP_CHAT_ID")
 RPC_URL = "https://testnet.dplabs-internal.com/"
 EXPLORER_URL = "https://https://pharos-testnet.socialscan.io/"
 CHAIN_ID = 688688
+DB_PATH = os.getenv("DB_PATH", "pharos_bot.db")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")  # self-hosted Bot API server, e.g. http://localhost:8081/bot
+
+# RPC endpoint pool: comma-separated node URLs, the fastest healthy one serves each call
+RPC_URLS = [url.strip() for url in os.getenv("RPC_URLS", RPC_URL).split(",") if url.strip()]
+RPC_HEDGE_AFTER = float(os.getenv("RPC_HEDGE_AFTER", "0.75"))  # seconds before a block fetch is also sent to a second node; 0 disables
+RPC_HEALTH_INTERVAL = float(os.getenv("RPC_HEALTH_INTERVAL", "15"))  # seconds between endpoint health checks
+RPC_MAX_HEAD_LAG = int(os.getenv("RPC_MAX_HEAD_LAG", "5"))  # blocks a node may trail the best head before it is skipped
+RPC_DOWN_TIME = float(os.getenv("RPC_DOWN_TIME", "10"))  # seconds a failed node is skipped, doubled per consecutive failure
+RPC_EWMA_ALPHA = 0.3  # weight of the newest sample in the latency average
+
+# RPC client tuning
+RPC_TIMEOUT = float(os.getenv("RPC_TIMEOUT", "15"))  # seconds per request
+RPC_MAX_RETRIES = int(os.getenv("RPC_MAX_RETRIES", "3"))
+RPC_RETRY_BACKOFF = float(os.getenv("RPC_RETRY_BACKOFF", "0.5"))  # seconds, doubled per attempt
+RPC_POOL_SIZE = int(os.getenv("RPC_POOL_SIZE", "20"))  # max open connections to the node
+RPC_KEEPALIVE = float(os.getenv("RPC_KEEPALIVE", "60"))  # seconds an idle connection is kept
+
+# Optional push mode: new heads via eth_subscribe("newHeads"), polling is the fallback
+WS_URL = os.getenv("WS_URL")  # e.g. wss://node.example/ws; unset disables push mode
+WS_RECONNECT_MAX = float(os.getenv("WS_RECONNECT_MAX", "60"))  # seconds, cap for reconnect backoff
+WS_STALE_TIMEOUT = float(os.getenv("WS_STALE_TIMEOUT", "30"))  # poll anyway if no head arrives for this long
+
+# Optional pending-transaction watch: provisional alerts for mempool transfers, edited once mined
+PENDING_WATCH = os.getenv("PENDING_WATCH", "0") == "1"
+PENDING_SOURCE = os.getenv("PENDING_SOURCE", "subscribe")  # "subscribe" (newPendingTransactions on WS_URL) or "txpool"
+PENDING_POLL_INTERVAL = float(os.getenv("PENDING_POLL_INTERVAL", "2"))  # seconds between txpool_content polls
+PENDING_MAX_HASHES = int(os.getenv("PENDING_MAX_HASHES", "50000"))  # pending hashes remembered at most
+PENDING_TTL = float(os.getenv("PENDING_TTL", "600"))  # seconds a pending hash or alert is remembered
+PENDING_FETCH_BATCH = 100  # hash-only notifications resolved per eth_getTransactionByHash batch
+
+# Adaptive head polling: polls follow the block time estimated from recent heads
+POLL_INTERVAL = 5  # seconds between head polls until the block time is measured
+POLL_MIN_INTERVAL = float(os.getenv("POLL_MIN_INTERVAL", "0.25"))  # seconds
+POLL_MAX_INTERVAL = float(os.getenv("POLL_MAX_INTERVAL", "10"))  # seconds
+BLOCK_TIME_SAMPLES = 20  # recent head changes used for the block time estimate
+ERROR_BACKOFF_BASE = float(os.getenv("ERROR_BACKOFF_BASE", "1"))  # seconds after the first failed pass, doubled per failure
+ERROR_BACKOFF_MAX = float(os.getenv("ERROR_BACKOFF_MAX", "60"))  # seconds
+
+# Optional ERC-20 Transfer scanning through eth_getLogs
+SCAN_ERC20 = os.getenv("SCAN_ERC20", "0") == "1"
+LOGS_BLOCK_RANGE = int(os.getenv("LOGS_BLOCK_RANGE", "1000"))  # max blocks per eth_getLogs query
+LOGS_ADDRESS_CHUNK = int(os.getenv("LOGS_ADDRESS_CHUNK", "200"))  # addresses per topic filter
+LOGS_RETRY_ATTEMPTS = 5  # passes a failed token range is retried in before it is given up
+LOGS_SCAN_TIMEOUT = float(os.getenv("LOGS_SCAN_TIMEOUT", "10"))  # seconds a pass spends on token ranges before deferring the rest
+TRANSFER_TOPIC = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"  # Transfer(address,address,uint256)
+
+# Block scanning
+SCAN_BATCH_SIZE = int(os.getenv("SCAN_BATCH_SIZE", "25"))  # blocks per JSON-RPC batch request
+SCAN_CONCURRENCY = int(os.getenv("SCAN_CONCURRENCY", "4"))  # batch requests in flight
+SCAN_MAX_BLOCKS = int(os.getenv("SCAN_MAX_BLOCKS", "1000"))  # blocks per pass before re-reading head
+FETCH_RECEIPTS = os.getenv("FETCH_RECEIPTS", "1") == "1"  # receipts of matched transactions: gas used, fee, status
+RECEIPTS_BLOCK_MIN = int(os.getenv("RECEIPTS_BLOCK_MIN", "8"))  # matched txs in a block before eth_getBlockReceipts pays off
+RECEIPTS_BATCH_SIZE = int(os.getenv("RECEIPTS_BATCH_SIZE", "100"))  # receipt calls per JSON-RPC batch request
+
+# Local cache of decoded blocks, so re-scans and backfills read disk instead of the network
+BLOCK_CACHE_PATH = os.getenv("BLOCK_CACHE_PATH", "block_cache.db")  # empty keeps the cache in memory only
+# Both limits count transactions, so they bound memory and disk use whatever the block size (~0.5 KB per cached transaction in memory, ~0.2 KB on disk)
+BLOCK_CACHE_MEMORY_TXS = int(os.getenv("BLOCK_CACHE_MEMORY_TXS", "20000"))  # transactions kept in the in-memory LRU
+BLOCK_CACHE_MAX_TXS = int(os.getenv("BLOCK_CACHE_MAX_TXS", "200000"))  # transactions of the most recent blocks kept on disk
+BLOCK_CACHE_REORG_DEPTH = 64  # cached blocks dropped below a block whose parent hash no longer matches
+
+# Backfill of blocks missed while the bot was down
+BACKFILL_CHUNK_SIZE = int(os.getenv("BACKFILL_CHUNK_SIZE", "500"))  # blocks per parallel chunk
+BACKFILL_WORKERS = int(os.getenv("BACKFILL_WORKERS", "4"))  # chunks scanned concurrently
+BACKFILL_MAX_BLOCKS = int(os.getenv("BACKFILL_MAX_BLOCKS", "200000"))  # older gaps are skipped
+
+# Process role: "all" runs everything in one process. For horizontal scaling run exactly
+# one "telegram" process (owns polling and commands) plus any number of "scanner" processes
+# sharing the database, which split the chain into leased block ranges.
+BOT_ROLE = os.getenv("BOT_ROLE", "all")
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+LEASE_SIZE = int(os.getenv("LEASE_SIZE", "100"))  # blocks per lease
+LEASE_TTL = float(os.getenv("LEASE_TTL", "120"))  # seconds before an unfinished lease is handed to another worker
+LEASE_HEARTBEAT = LEASE_TTL / 4  # seconds between lease renewals and scanner liveness updates
+INDEX_REFRESH_INTERVAL = float(os.getenv("INDEX_REFRESH_INTERVAL", "10"))  # seconds between wallet change checks
+
+# Write-behind buffering of tracked_transactions rows
+TRACK_FLUSH_MAX_ROWS = int(os.getenv("TRACK_FLUSH_MAX_ROWS", "500"))
+TRACK_FLUSH_INTERVAL = float(os.getenv("TRACK_FLUSH_INTERVAL", "2"))  # seconds
+
+# Notification delivery (Telegram allows ~30 msg/s overall and ~1 msg/s per chat)
+NOTIFY_GLOBAL_RATE = float(os.getenv("NOTIFY_GLOBAL_RATE", "25"))  # messages per second, all chats
+NOTIFY_CHAT_RATE = float(os.getenv("NOTIFY_CHAT_RATE", "1"))  # messages per second, per chat
+NOTIFY_WORKERS = int(os.getenv("NOTIFY_WORKERS", "4"))
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "5"))
+DIGEST_WINDOW = float(os.getenv("DIGEST_WINDOW", "1.5"))  # seconds to collect events into one message
+DIGEST_MAX_ITEMS = 10  # transactions listed in a digest before summarizing the rest
+
+# Wallet subscriptions
+MAX_WALLETS_PER_USER = int(os.getenv("MAX_WALLETS_PER_USER", "10"))
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "10"))  # transactions per /history page
+
+# Group membership cache
+MEMBERSHIP_TTL = float(os.getenv("MEMBERSHIP_TTL", "3600"))  # seconds a positive result is trusted
+MEMBERSHIP_NEGATIVE_TTL = float(os.getenv("MEMBERSHIP_NEGATIVE_TTL", "60"))  # seconds a negative result is trusted
+PAUSE_ON_LEAVE = os.getenv("PAUSE_ON_LEAVE", "1") == "1"  # stop monitoring wallets of users who leave the group
+# Include 'restricted' status as well, since some groups have restrictions
+MEMBER_STATUSES = ('member', 'administrator', 'creator', 'restricted')
+
+# Metrics and health check served on the keep-alive web server
+HEALTH_MAX_LAG = int(os.getenv("HEALTH_MAX_LAG", "100"))  # blocks behind head before /healthz fails
+WEB_PORT = int(os.getenv("PORT", "8080"))
+
+# Optional webhook mode: Telegram pushes updates instead of being long-polled, and the
+# webhook, keep-alive and metrics routes share one aiohttp server in the bot's event loop
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # public https base URL, e.g. https://bot.example; unset keeps polling
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+# Expected X-Telegram-Bot-Api-Secret-Token header; without one a random secret is registered on every start,
+# since the endpoint would otherwise accept forged updates from anyone who finds it
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+
+WEI_PER_PHRS = Decimal(10) ** 18
+
+# Notification labels per transaction direction
+TX_TYPE_LABELS = {
+    "outgoing": ("📤", "Keluar"),
+    "incoming": ("📥", "Masuk"),
+    "self": ("🔄", "Ke Diri Sendiri"),
+}
+
+# Metrics
+#
+# A minimal in-process registry rendered in the Prometheus text format. Updates
+# are plain dict and float operations on the event loop (or the database
+# thread), cheap enough for the hot scan loop; /metrics only reads them.
+
+METRICS: list = []
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Metric:
+    """Base metric: one value per tuple of label values"""
+    kind = 'untyped'
+    
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = labels
+        self.values: dict = {}
+        METRICS.append(self)
+    
+    def _labels(self, values: tuple, extra: str = '') -> str:
+        pairs = [
+            '%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+            for name, value in zip(self.label_names, values)
+        ]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+    
+    def samples(self):
+        for values, value in list(self.values.items()):
+            yield f"{self.name}{self._labels(values)} {value}"
+    
+    def render(self) -> str:
+        return '\n'.join([f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self.samples()])
+
+class Counter(Metric):
+    kind = 'counter'
+    
+    def inc(self, labels: tuple = (), amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+class Gauge(Metric):
+    kind = 'gauge'
+    
+    def __init__(self, name: str, help_text: str, labels: tuple = (), func=None):
+        super().__init__(name, help_text, labels)
+        self.func = func  # computed at scrape time instead of set
+    
+    def set(self, value: float, labels: tuple = ()):
+        self.values[labels] = value
+    
+    def inc(self, labels: tuple = (), amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+    
+    def set_function(self, func):
+        self.func = func
+    
+    def get(self, labels: tuple = ()) -> float:
+        if self.func is not None:
+            return self.func()
+        return self.values.get(labels, 0)
+    
+    def samples(self):
+        if self.func is not None:
+            yield f"{self.name} {self.func()}"
+        else:
+            yield from super().samples()
+
+class Histogram(Metric):
+    kind = 'histogram'
+    
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = buckets
+    
+    def observe(self, value: float, labels: tuple = ()):
+        state = self.values.get(labels)
+        if state is None:
+            state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]  # per-bucket counts, sum
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+    
+    def time(self, labels: tuple = ()) -> 'Timer':
+        """Context manager observing the elapsed time of its block"""
+        return Timer(self, labels)
+    
+    def samples(self):
+        for values, (counts, total) in list(self.values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), list(counts)):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{self._labels(values, le)} {cumulative}"
+            yield f"{self.name}_sum{self._labels(values)} {total}"
+            yield f"{self.name}_count{self._labels(values)} {cumulative}"
+
+class Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+    
+    def __init__(self, histogram: Histogram, labels: tuple):
+        self.histogram = histogram
+        self.labels = labels
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, self.labels)
+
+def render_metrics() -> str:
+    return '\n'.join(metric.render() for metric in METRICS) + '\n'
+
+def health_status() -> tuple[str, int]:
+    """Return the /healthz body and HTTP status"""
+    lag = HEAD_LAG.get()
+    if lag > HEALTH_MAX_LAG:
+        return f"unhealthy: {lag} blocks behind head\n", 503
+    return f"ok: {lag} blocks behind head\n", 200
+
+HEAD_BLOCK = Gauge('pharos_head_block', 'Latest block number seen on the node')
+SCANNED_BLOCK = Gauge('pharos_last_checked_block', 'Highest block scanned by this process')
+HEAD_LAG = Gauge(
+    'pharos_head_lag_blocks', 'Blocks between the node head and the last scanned block',
+    func=lambda: max(0, HEAD_BLOCK.get() - SCANNED_BLOCK.get())
+)
+BLOCK_TIME = Gauge('pharos_block_time_seconds', 'Estimated seconds between blocks, 0 until measured')
+BLOCKS_SCANNED = Counter('pharos_blocks_scanned_total', 'Blocks scanned; rate() gives blocks per second')
+MATCHED_TRANSACTIONS = Counter('pharos_matched_transactions_total', 'New transactions matched to a user', ('type',))
+RPC_LATENCY = Histogram('pharos_rpc_duration_seconds', 'JSON-RPC request latency including retries', ('method',))
+RPC_ERRORS = Counter('pharos_rpc_errors_total', 'Failed JSON-RPC requests', ('method',))
+BLOCK_CACHE_LOOKUPS = Counter('pharos_block_cache_lookups_total', 'Block lookups by where they were served from', ('result',))
+RPC_HEDGES = Counter('pharos_rpc_hedged_total', 'Block fetches also sent to a second node after RPC_HEDGE_AFTER')
+RPC_ENDPOINT_LATENCY = Gauge('pharos_rpc_endpoint_latency_seconds', 'EWMA request latency per node', ('url',))
+RPC_ENDPOINT_HEAD = Gauge('pharos_rpc_endpoint_head_block', 'Head block reported by each node', ('url',))
+NOTIFY_QUEUE_DEPTH = Gauge('pharos_notify_queue_depth', 'Notifications waiting to be delivered')
+NOTIFY_LATENCY = Histogram('pharos_notify_send_duration_seconds', 'Telegram sendMessage latency')
+NOTIFY_SENT = Counter('pharos_notify_sent_total', 'Notification delivery results', ('result',))
+PENDING_ALERTS = Counter('pharos_pending_alerts_total', 'Provisional alerts for pending transactions', ('result',))
+NOTIFY_RETRY_AFTER = Counter('pharos_notify_retry_after_total', 'Telegram 429 flood limit responses')
+DB_QUERY_LATENCY = Histogram(
+    'pharos_db_query_duration_seconds', 'SQLite time per operation on the database thread', ('operation',),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+)
+COMMAND_LATENCY = Histogram('pharos_command_duration_seconds', 'Telegram command handler latency', ('command',))
 
 # Database setup
-def init_database():
-    """Initialize SQLite database for storing user data"""
-    conn = sqlite3.connect('pharos_bot.db')
-    cursor = conn.cursor()
+# Transactions table for tracking; one row per notified user, since a transaction can match several.
+# direction, counterparty, value and token are what /history renders, so it never calls the node;
+# gas_used, fee and status come from the transaction receipt (NULL when receipts are not fetched).
+TRACKED_TRANSACTIONS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS tracked_transactions (
+        tx_hash TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        block_number INTEGER,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        direction TEXT,
+        counterparty TEXT,
+        value TEXT,
+        token TEXT,
+        gas_used INTEGER,
+        fee TEXT,
+        status INTEGER,
+        PRIMARY KEY (tx_hash, user_id),
+        FOREIGN KEY (user_id) REFERENCES users (user_id)
+    )
+'''
+
+SCHEMA = [
+    # Users table (wallet_address is the pre-subscriptions single wallet, kept for old databases)
+    '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            wallet_address TEXT UNIQUE,
+            last_block_checked INTEGER DEFAULT 0,
+            is_group_member BOOLEAN DEFAULT 0,
+            registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''',
+    # Wallets monitored per user: many wallets per user, many users per wallet.
+    # Addresses are stored as normalized 20-byte blobs, so checksum and lowercase forms match.
+    '''
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            user_id INTEGER NOT NULL,
+            address BLOB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, address),
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        ) WITHOUT ROWID
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_subscriptions_address ON subscriptions (address)',
+    TRACKED_TRANSACTIONS_TABLE,
+    # Key/value table for scanner state (e.g. the durable block cursor)
+    '''
+        CREATE TABLE IF NOT EXISTS scan_state (
+            key TEXT PRIMARY KEY,
+            value INTEGER
+        )
+    ''',
+    # Block ranges claimed by scanner workers (BOT_ROLE=scanner)
+    '''
+        CREATE TABLE IF NOT EXISTS scan_leases (
+            start_block INTEGER PRIMARY KEY,
+            end_block INTEGER NOT NULL,
+            owner TEXT,
+            expires_at REAL,
+            completed INTEGER DEFAULT 0
+        )
+    ''',
+    # Live scanner workers, so they can split the notification rate limits between them
+    '''
+        CREATE TABLE IF NOT EXISTS scan_workers (
+            owner TEXT PRIMARY KEY,
+            seen_at REAL NOT NULL
+        )
+    ''',
+]
+
+# Bumped whenever the set of monitored wallets changes, so scanner workers know to reload
+BUMP_INDEX_VERSION = (
+    "INSERT INTO scan_state (key, value) VALUES ('index_version', 1) "
+    "ON CONFLICT(key) DO UPDATE SET value = value + 1"
+)
+
+# Columns added after the first release: (table, column, definition)
+MIGRATIONS = [
+    ('users', 'monitoring_paused', 'INTEGER DEFAULT 0'),
+    ('tracked_transactions', 'direction', 'TEXT'),
+    ('tracked_transactions', 'counterparty', 'TEXT'),
+    ('tracked_transactions', 'value', 'TEXT'),
+    ('tracked_transactions', 'token', 'TEXT'),
+    ('tracked_transactions', 'gas_used', 'INTEGER'),
+    ('tracked_transactions', 'fee', 'TEXT'),
+    ('tracked_transactions', 'status', 'INTEGER'),
+]
+
+# Indexes over migrated columns, created once MIGRATIONS have run
+INDEXES = [
+    # Covers /history pages: a range seek per page, newest block first, no table lookups
+    'CREATE INDEX IF NOT EXISTS idx_tracked_user_block ON tracked_transactions '
+    '(user_id, block_number, direction, counterparty, value, token, tx_hash)',
+]
+
+# Decoded blocks in the block cache file: compact transaction tuples as JSON
+BLOCK_CACHE_TABLE = '''
+    CREATE TABLE IF NOT EXISTS block_cache (
+        number INTEGER PRIMARY KEY,
+        hash TEXT NOT NULL,
+        tx_count INTEGER NOT NULL,
+        txs TEXT NOT NULL
+    )
+'''
+
+# Connection tuning applied once to the shared connection
+PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',  # WAL stays consistent; only the last commits can be lost on power failure
+    'PRAGMA busy_timeout=5000',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-16000',  # ~16 MB page cache
+]
+
+class Database:
+    """Shared SQLite access layer.
+    
+    Owns one long-lived connection in WAL mode. Every query runs on a single
+    dedicated worker thread, so disk I/O never blocks the event loop and the
+    connection is never used from two threads at once. SQL strings are reused
+    verbatim so sqlite3's statement cache keeps them prepared.
+    """
+    
+    def __init__(self, path: str = DB_PATH):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite')
+    
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=256)
+            for pragma in PRAGMAS:
+                self._conn.execute(pragma)
+        return self._conn
+    
+    async def _run(self, operation: str, func, *args):
+        """Run func(connection, *args) on the database thread, timed under operation (e.g. "claim_lease")"""
+        labels = (operation,)
+        
+        def timed():
+            start = time.perf_counter()
+            try:
+                return func(self._connection(), *args)
+            finally:
+                DB_QUERY_LATENCY.observe(time.perf_counter() - start, labels)
+        
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, timed)
+    
+    async def execute(self, operation: str, sql: str, params: tuple = ()) -> int:
+        """Execute one write statement in its own transaction and return the row count"""
+        def work(conn):
+            with conn:
+                return conn.execute(sql, params).rowcount
+        return await self._run(operation, work)
+    
+    async def fetchone(self, operation: str, sql: str, params: tuple = ()):
+        return await self._run(operation, lambda conn: conn.execute(sql, params).fetchone())
+    
+    async def fetchall(self, operation: str, sql: str, params: tuple = ()) -> list:
+        return await self._run(operation, lambda conn: conn.execute(sql, params).fetchall())
+    
+    async def transaction(self, operation: str, func):
+        """Run func(connection) inside a single transaction on the database thread"""
+        def work(conn):
+            with conn:
+                return func(conn)
+        return await self._run(operation, work)
+    
+    async def init_schema(self):
+        """Initialize SQLite database for storing user data.
+        
+        sqlite3 does not open a transaction for DDL on its own, so the whole
+        schema setup and migration runs inside an explicit BEGIN IMMEDIATE: a
+        failure halfway through a table rebuild rolls back to the old table.
+        """
+        def work(conn):
+            conn.execute('BEGIN IMMEDIATE')
+            with conn:
+                for statement in SCHEMA:
+                    conn.execute(statement)
+                for table, column, definition in MIGRATIONS:
+                    columns = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+                    if column not in columns:
+                        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+                self._migrate_tracked_key(conn)
+                self._migrate_wallets(conn)
+                for statement in INDEXES:
+                    conn.execute(statement)
+        await self._run('init_schema', work)
+    
+    @staticmethod
+    def _migrate_tracked_key(conn):
+        """Rebuild an old tracked_transactions keyed on tx_hash alone with the (tx_hash, user_id) key"""
+        key = [row[1] for row in conn.execute('PRAGMA table_info(tracked_transactions)') if row[5]]
+        if key != ['tx_hash']:
+            return
+        conn.execute('ALTER TABLE tracked_transactions RENAME TO tracked_transactions_old')
+        conn.execute(TRACKED_TRANSACTIONS_TABLE)
+        conn.execute(
+            'INSERT OR IGNORE INTO tracked_transactions (tx_hash, user_id, block_number, timestamp) '
+            'SELECT tx_hash, user_id, block_number, timestamp FROM tracked_transactions_old WHERE user_id IS NOT NULL'
+        )
+        conn.execute('DROP TABLE tracked_transactions_old')
+    
+    @staticmethod
+    def _migrate_wallets(conn):
+        """Copy the single users.wallet_address of old databases into subscriptions, once"""
+        if conn.execute("SELECT 1 FROM scan_state WHERE key = 'subscriptions_migrated'").fetchone():
+            return
+        rows = conn.execute('SELECT user_id, wallet_address FROM users WHERE wallet_address IS NOT NULL').fetchall()
+        conn.executemany(
+            'INSERT OR IGNORE INTO subscriptions (user_id, address) VALUES (?, ?)',
+            [(user_id, address_key(wallet)) for user_id, wallet in rows if address_key(wallet)]
+        )
+        conn.execute("INSERT INTO scan_state (key, value) VALUES ('subscriptions_migrated', 1)")
+    
+    async def close(self):
+        def work(conn):
+            conn.close()
+            self._conn = None
+        if self._conn is not None:
+            await self._run('close', work)
+        self._executor.shutdown(wait=True)
+    
+    # Users
+    
+    async def store_user_info(self, user_id: int, username: str):
+        await self.execute('store_user_info', 'INSERT OR IGNORE INTO users (user_id, username) VALUES (?, ?)', (user_id, username))
+    
+    async def get_user_status(self, user_id: int):
+        return await self.fetchone(
+            'get_user_status', 'SELECT is_group_member, registered_at, monitoring_paused FROM users WHERE user_id = ?', (user_id,)
+        )
+    
+    async def set_group_member(self, user_id: int, is_member: bool):
+        await self.execute('set_group_member', 'UPDATE users SET is_group_member = ? WHERE user_id = ?', (is_member, user_id))
+    
+    # Subscriptions
+    
+    async def get_wallets(self, user_id: int) -> list:
+        """Return the user's subscribed addresses as lowercase hex, oldest first"""
+        rows = await self.fetchall(
+            'get_wallets', 'SELECT address FROM subscriptions WHERE user_id = ? ORDER BY created_at, address', (user_id,)
+        )
+        return ['0x' + row[0].hex() for row in rows]
+    
+    async def add_subscription(self, user_id: int, wallet_address: str) -> str:
+        """Subscribe user_id to wallet_address, returning "new", "exists" or "limit" """
+        key = address_key(wallet_address)
+        
+        def work(conn):
+            if conn.execute('SELECT 1 FROM subscriptions WHERE user_id = ? AND address = ?', (user_id, key)).fetchone():
+                # Registering again resumes a user paused on leaving the group
+                if conn.execute(
+                    'UPDATE users SET monitoring_paused = 0 WHERE user_id = ? AND monitoring_paused = 1', (user_id,)
+                ).rowcount:
+                    conn.execute(BUMP_INDEX_VERSION)
+                return "exists"
+            count = conn.execute('SELECT COUNT(*) FROM subscriptions WHERE user_id = ?', (user_id,)).fetchone()[0]
+            if count >= MAX_WALLETS_PER_USER:
+                return "limit"
+            
+            conn.execute('INSERT OR IGNORE INTO users (user_id) VALUES (?)', (user_id,))
+            conn.execute('INSERT INTO subscriptions (user_id, address) VALUES (?, ?)', (user_id, key))
+            conn.execute('UPDATE users SET monitoring_paused = 0 WHERE user_id = ?', (user_id,))
+            conn.execute(BUMP_INDEX_VERSION)
+            return "new"
+        return await self.transaction('add_subscription', work)
+    
+    async def remove_subscription(self, user_id: int, wallet_address: str) -> bool:
+        """Unsubscribe user_id from one wallet, returning whether it was subscribed"""
+        def work(conn):
+            removed = conn.execute(
+                'DELETE FROM subscriptions WHERE user_id = ? AND address = ?', (user_id, address_key(wallet_address))
+            ).rowcount
+            if removed:
+                conn.execute(BUMP_INDEX_VERSION)
+            return bool(removed)
+        return await self.transaction('remove_subscription', work)
+    
+    async def clear_subscriptions(self, user_id: int) -> list:
+        """Unsubscribe user_id from all wallets, returning the removed addresses"""
+        def work(conn):
+            rows = conn.execute('SELECT address FROM subscriptions WHERE user_id = ?', (user_id,)).fetchall()
+            if rows:
+                conn.execute('DELETE FROM subscriptions WHERE user_id = ?', (user_id,))
+                conn.execute(BUMP_INDEX_VERSION)
+            return ['0x' + row[0].hex() for row in rows]
+        return await self.transaction('clear_subscriptions', work)
+    
+    async def iter_monitored_wallets(self, batch_size: int = 5000):
+        """Yield batches of (user_id, 20-byte address) for every subscription of users not paused.
+        
+        Rows are streamed with fetchmany, so the full result set is never held in one list.
+        """
+        cursor = await self._run('iter_monitored_wallets', lambda conn: conn.execute(
+            'SELECT s.user_id, s.address FROM subscriptions s JOIN users u ON u.user_id = s.user_id '
+            'WHERE u.monitoring_paused = 0'
+        ))
+        try:
+            while True:
+                rows = await self._run('iter_monitored_wallets', lambda conn: cursor.fetchmany(batch_size))
+                if not rows:
+                    break
+                yield rows
+        finally:
+            await self._run('iter_monitored_wallets', lambda conn: cursor.close())
+    
+    async def load_group_members(self) -> list:
+        """Return the user ids last known to be in the group"""
+        rows = await self.fetchall('load_group_members', 'SELECT user_id FROM users WHERE is_group_member = 1')
+        return [row[0] for row in rows]
+    
+    async def set_monitoring_paused(self, user_id: int, paused: bool) -> list:
+        """Pause or resume monitoring for a user, returning their subscribed wallets.
+        
+        Scanners only reload when the flag changes for a user with wallets, so
+        join and leave bursts of users without wallets cost no index reloads.
+        """
+        def work(conn):
+            changed = conn.execute(
+                'UPDATE users SET monitoring_paused = ? WHERE user_id = ? AND monitoring_paused IS NOT ?',
+                (int(paused), user_id, int(paused))
+            ).rowcount
+            if changed and conn.execute('SELECT 1 FROM subscriptions WHERE user_id = ? LIMIT 1', (user_id,)).fetchone():
+                conn.execute(BUMP_INDEX_VERSION)
+        await self.transaction('set_monitoring_paused', work)
+        return await self.get_wallets(user_id)
+    
+    # Tracked transactions
+    
+    async def filter_tracked(self, keys: list) -> Set[tuple]:
+        """Return the subset of (tx_hash, user_id) keys already stored in tracked_transactions"""
+        tx_hashes = {tx_hash for tx_hash, _ in keys}
+        rows = await self.fetchall(
+            'filter_tracked',
+            f'SELECT tx_hash, user_id FROM tracked_transactions WHERE tx_hash IN ({",".join("?" * len(tx_hashes))})',
+            tuple(tx_hashes)
+        )
+        return set(keys).intersection(rows)
+    
+    async def write_tracked(self, rows: list, cursor_block: Optional[int] = None, completed_leases: tuple = ()):
+        """Insert tracked_transactions rows and move the scan cursor or finish leases, in one transaction"""
+        def work(conn):
+            conn.executemany(
+                'INSERT OR IGNORE INTO tracked_transactions (tx_hash, user_id, block_number, direction, '
+                'counterparty, value, token, gas_used, fee, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                rows
+            )
+            if cursor_block is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO scan_state (key, value) VALUES ('last_checked_block', ?)",
+                    (cursor_block,)
+                )
+            for start_block, owner in completed_leases:
+                self._complete_lease(conn, start_block, owner)
+        await self.transaction('write_tracked', work)
+    
+    async def load_history(self, user_id: int, before_block: Optional[int] = None, limit: int = HISTORY_PAGE_SIZE) -> tuple:
+        """Return (rows, has_more): a page of a user's tracked transactions, newest block first.
+        
+        Keyset pagination on block_number: a page holds the newest blocks below
+        before_block, up to limit rows but never splitting a block, so the next
+        page starts below its lowest block number. Every query is a range seek
+        on idx_tracked_user_block. Rows are (block_number, direction,
+        counterparty, value, token, tx_hash).
+        """
+        upper = 'AND block_number < ?' if before_block is not None else 'AND block_number IS NOT NULL'
+        params = (user_id, before_block) if before_block is not None else (user_id,)
+        
+        def work(conn):
+            lowest = conn.execute(
+                f'SELECT MIN(block_number) FROM (SELECT block_number FROM tracked_transactions '
+                f'WHERE user_id = ? {upper} ORDER BY block_number DESC LIMIT ?)',
+                (*params, limit)
+            ).fetchone()[0]
+            if lowest is None:
+                return [], False
+            rows = conn.execute(
+                'SELECT block_number, direction, counterparty, value, token, tx_hash FROM tracked_transactions '
+                f'WHERE user_id = ? {upper} AND block_number >= ? ORDER BY block_number DESC',
+                (*params, lowest)
+            ).fetchall()
+            has_more = conn.execute(
+                'SELECT 1 FROM tracked_transactions WHERE user_id = ? AND block_number < ? LIMIT 1',
+                (user_id, lowest)
+            ).fetchone() is not None
+            return rows, has_more
+        return await self._run('load_history', work)
+    
+    # Scanner state
+    
+    async def load_scan_cursor(self) -> Optional[int]:
+        """Return the last fully processed block number, if one was saved"""
+        result = await self.fetchone('load_scan_cursor', "SELECT value FROM scan_state WHERE key = 'last_checked_block'")
+        return result[0] if result else None
+    
+    async def get_index_version(self) -> int:
+        result = await self.fetchone('get_index_version', "SELECT value FROM scan_state WHERE key = 'index_version'")
+        return result[0] if result else 0
+    
+    async def claim_lease(self, owner: str, latest_block: int) -> Optional[tuple]:
+        """Claim a block range for owner, returning (start_block, end_block) or None when caught up.
+        
+        Expired, unfinished leases of dead workers are handed out first;
+        otherwise a new lease of up to LEASE_SIZE blocks is cut after the
+        highest existing one. BEGIN IMMEDIATE serializes claims across processes.
+        """
+        def work(conn):
+            now = time.time()
+            conn.execute('BEGIN IMMEDIATE')
+            with conn:
+                expired = conn.execute(
+                    'SELECT start_block, end_block FROM scan_leases WHERE completed = 0 AND expires_at < ? '
+                    'ORDER BY start_block LIMIT 1', (now,)
+                ).fetchone()
+                if expired:
+                    conn.execute(
+                        'UPDATE scan_leases SET owner = ?, expires_at = ? WHERE start_block = ?',
+                        (owner, now + LEASE_TTL, expired[0])
+                    )
+                    return expired
+                
+                highest = conn.execute('SELECT MAX(end_block) FROM scan_leases').fetchone()[0]
+                if highest is None:
+                    cursor = conn.execute("SELECT value FROM scan_state WHERE key = 'last_checked_block'").fetchone()
+                    if cursor is None and latest_block <= 0:
+                        return None  # No cursor and no real head: the first lease would start from genesis
+                    highest = cursor[0] if cursor else latest_block - 1
+                start_block = highest + 1
+                if start_block > latest_block:
+                    return None
+                end_block = min(start_block + LEASE_SIZE - 1, latest_block)
+                conn.execute(
+                    'INSERT INTO scan_leases (start_block, end_block, owner, expires_at) VALUES (?, ?, ?, ?)',
+                    (start_block, end_block, owner, now + LEASE_TTL)
+                )
+                return start_block, end_block
+        return await self._run('claim_lease', work)
+    
+    async def heartbeat(self, owner: str, lease_start: Optional[int] = None) -> tuple:
+        """Mark owner alive and extend its unfinished lease, returning (live workers, lease still held).
+        
+        Workers not seen for LEASE_TTL are forgotten.
+        """
+        def work(conn):
+            now = time.time()
+            conn.execute('INSERT OR REPLACE INTO scan_workers (owner, seen_at) VALUES (?, ?)', (owner, now))
+            conn.execute('DELETE FROM scan_workers WHERE seen_at < ?', (now - LEASE_TTL,))
+            # Also renews finished leases still waiting for their notifications to go out
+            conn.execute(
+                'UPDATE scan_leases SET expires_at = ? WHERE owner = ? AND completed = 0', (now + LEASE_TTL, owner)
+            )
+            held = True
+            if lease_start is not None:
+                held = conn.execute(
+                    'SELECT 1 FROM scan_leases WHERE start_block = ? AND owner = ? AND completed = 0',
+                    (lease_start, owner)
+                ).fetchone() is not None
+            return conn.execute('SELECT COUNT(*) FROM scan_workers').fetchone()[0], held
+        return await self.transaction('heartbeat', work)
+    
+    async def remove_worker(self, owner: str):
+        await self.execute('remove_worker', 'DELETE FROM scan_workers WHERE owner = ?', (owner,))
+    
+    @staticmethod
+    def _complete_lease(conn, start_block: int, owner: str):
+        """Mark a lease done and fold finished leases at the bottom into the scan cursor"""
+        conn.execute(
+            'UPDATE scan_leases SET completed = 1 WHERE start_block = ? AND owner = ?', (start_block, owner)
+        )
+        cursor = conn.execute("SELECT value FROM scan_state WHERE key = 'last_checked_block'").fetchone()
+        if cursor is None:
+            lowest = conn.execute('SELECT MIN(start_block) FROM scan_leases').fetchone()[0]
+            cursor = (lowest - 1,) if lowest is not None else None
+        if cursor is None:
+            return
+        
+        last_checked = cursor[0]
+        while True:
+            lease = conn.execute(
+                'SELECT end_block FROM scan_leases WHERE start_block = ? AND completed = 1', (last_checked + 1,)
+            ).fetchone()
+            if lease is None:
+                break
+            conn.execute('DELETE FROM scan_leases WHERE start_block = ?', (last_checked + 1,))
+            last_checked = lease[0]
+        conn.execute(
+            "INSERT OR REPLACE INTO scan_state (key, value) VALUES ('last_checked_block', ?)", (last_checked,)
+        )
+
+class TrackedTransactionBuffer:
+    """Write-behind buffer for tracked_transactions rows.
+    
+    Rows are collected in memory and written with executemany in a single
+    transaction, either when a scan pass finishes (together with the scan
+    cursor, so a block is never recorded as scanned without its rows) or early
+    when TRACK_FLUSH_MAX_ROWS / TRACK_FLUSH_INTERVAL is reached.
+    
+    A row whose notification is still queued is held back until release():
+    a recorded row suppresses the notification when its block is scanned
+    again, so it must not be written before the user was notified. The
+    cursor stays below, and a finished lease stays open over, any held row.
+    """
+    
+    def __init__(self, db: Database):
+        self.db = db
+        self._rows: list = []
+        self._held: Dict[tuple, tuple] = {}  # (tx_hash, user_id) -> row waiting for its notification
+        self._leases: list = []  # finished (start_block, end_block, owner) leases not yet written
+        self._keys: Set[tuple] = set()  # (tx_hash, user_id)
+        self._first_added = 0.0
+        self._lock = asyncio.Lock()  # keeps flushes (and cursor writes) in call order
+    
+    def add(self, tx: dict, held: bool = False):
+        """Queue the tracked_transactions row of a matched transaction entry, held until release() if asked"""
+        counterparty = tx['from'] if tx['type'] == "incoming" else tx['to']
+        fee = tx.get('fee')
+        row = (
+            tx['tx_hash'], tx['user_id'], tx['block_number'],
+            tx['type'], counterparty, str(tx['value']), tx.get('token', 'PHRS'),
+            tx.get('gas_used'), str(fee) if fee is not None else None, tx.get('status')
+        )
+        key = (tx['tx_hash'], tx['user_id'])
+        self._keys.add(key)
+        if held:
+            self._held[key] = row
+        else:
+            self._append(row)
+    
+    def release(self, key: tuple):
+        """Let a held row be written: its notification was delivered or given up on"""
+        row = self._held.pop(key, None)
+        if row is not None:
+            self._append(row)
+    
+    def _append(self, row: tuple):
+        if not self._rows:
+            self._first_added = time.monotonic()
+        self._rows.append(row)
+    
+    def __contains__(self, key: tuple) -> bool:
+        return key in self._keys
+    
+    def __len__(self) -> int:
+        return len(self._rows)
+    
+    def is_due(self) -> bool:
+        return bool(self._rows) and (
+            len(self._rows) >= TRACK_FLUSH_MAX_ROWS
+            or time.monotonic() - self._first_added >= TRACK_FLUSH_INTERVAL
+        )
+    
+    async def flush(self, cursor_block: Optional[int] = None, completed_lease: Optional[tuple] = None):
+        """Write released rows, and the scan cursor or finished (start_block, end_block, owner) lease, in one transaction"""
+        async with self._lock:
+            if completed_lease is not None:
+                self._leases.append(completed_lease)
+            held_blocks = {row[2] for row in self._held.values()}
+            if held_blocks and cursor_block is not None:
+                cursor_block = min(cursor_block, min(held_blocks) - 1)
+            leases = [
+                lease for lease in self._leases
+                if not any(lease[0] <= block <= lease[1] for block in held_blocks)
+            ]
+            rows = self._rows
+            if not rows and cursor_block is None and not leases:
+                return
+            keys = {(row[0], row[1]) for row in rows}
+            self._rows = []
+            self._keys -= keys
+            self._leases = [lease for lease in self._leases if lease not in leases]
+            try:
+                await self.db.write_tracked(rows, cursor_block, tuple((start, owner) for start, _, owner in leases))
+            except Exception:
+                # Keep the rows and leases so the next flush retries them
+                self._rows = rows + self._rows
+                self._keys |= keys
+                self._leases = leases + self._leases
+                raise
+
+# Address helpers from eth_utils, imported on first use: web3 is not imported at all,
+# since loading it added more than a second to every cold start
+def to_checksum_address(address: str) -> str:
+    from eth_utils import to_checksum_address as checksum
+    return checksum(address)
+
+def is_address(address: str) -> bool:
+    from eth_utils import is_address as check
+    return check(address)
+
+def address_key(address: Optional[str]) -> Optional[bytes]:
+    """Normalize a hex address into its 20-byte binary form"""
+    if not address:
+        return None
+    if address[:2] in ('0x', '0X'):
+        address = address[2:]
+    try:
+        key = bytes.fromhex(address)
+    except ValueError:
+        return None
+    return key if len(key) == 20 else None
+
+NO_USERS: tuple = ()
+
+class AddressIndex:
+    """Inverted index of monitored addresses: normalized 20-byte address -> tuple of subscribed user ids"""
+    __slots__ = ('_users',)
+
+    def __init__(self):
+        self._users: Dict[bytes, tuple] = {}
+
+    def add(self, address: str, user_id: int) -> bool:
+        key = address_key(address)
+        if key is None:
+            return False
+        self.add_key(key, user_id)
+        return True
+    
+    def add_key(self, key: bytes, user_id: int):
+        users = self._users.get(key, NO_USERS)
+        if user_id not in users:
+            self._users[key] = users + (user_id,)
+
+    def remove(self, address: str, user_id: int) -> bool:
+        """Drop one user's subscription to address, returning whether it was indexed"""
+        key = address_key(address)
+        users = self._users.get(key, NO_USERS)
+        if user_id not in users:
+            return False
+        remaining = tuple(u for u in users if u != user_id)
+        if remaining:
+            self._users[key] = remaining
+        else:
+            del self._users[key]
+        return True
+
+    def get(self, address: Optional[str]) -> tuple:
+        """Return the user ids subscribed to address (empty if none)"""
+        key = address_key(address)
+        if key is None:
+            return NO_USERS
+        return self._users.get(key, NO_USERS)
+
+    def clear(self):
+        self._users.clear()
+
+    def __contains__(self, address) -> bool:
+        return bool(self.get(address))
+    
+    def __iter__(self):
+        """Iterate over the 20-byte address keys"""
+        return iter(self._users)
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+class RPCError(Exception):
+    """Error object returned by the node for a JSON-RPC call"""
+    
+    def __init__(self, method: str, error):
+        self.method = method
+        self.code = error.get('code') if isinstance(error, dict) else None
+        message = error.get('message', error) if isinstance(error, dict) else error
+        super().__init__(f"{method}: {message}")
+    
+    @property
+    def method_not_found(self) -> bool:
+        """Whether the node lacks the method altogether, rather than failing this one call"""
+        return self.code == -32601 or (
+            self.code is not None and any(text in str(self).lower() for text in ('method not found', 'does not exist', 'not supported'))
+        )
+
+def decode_block_transactions(block: dict) -> list:
+    """Reduce a raw eth_getBlockByNumber result to (hash, from, to, value, gas) tuples.
+    
+    Fields stay as the hex strings the node sent; no web3 result formatting,
+    AttributeDict or HexBytes objects are built per transaction.
+    """
+    return [(tx['hash'], tx['from'], tx.get('to'), tx['value'], tx['gas']) for tx in block['transactions']]
+
+class BlockCache:
+    """Decoded blocks: an in-memory LRU in front of a bounded SQLite store.
+    
+    Only the compact transaction tuples of decode_block_transactions are kept,
+    with the block hash. Both tiers are bounded by transaction count rather
+    than block count: the LRU holds up to BLOCK_CACHE_MEMORY_TXS transactions
+    and the store the newest blocks up to BLOCK_CACHE_MAX_TXS. When a fetched
+    block's parentHash differs from the cached hash of the block before it,
+    the chain was reorganized and the cached blocks below it are dropped, so
+    the next re-scan fetches them again.
+    """
+    
+    def __init__(self, path: Optional[str]):
+        self._memory: OrderedDict = OrderedDict()  # block number -> (hash, transactions)
+        self._memory_txs = 0
+        self.db = Database(path) if path else None
+        self._ready = False
+        self._disk_txs: Optional[int] = None  # transactions in the store, only used on the database thread
+    
+    async def _store(self) -> Database:
+        if not self._ready:
+            def work(conn):
+                columns = {row[1] for row in conn.execute('PRAGMA table_info(block_cache)')}
+                if columns and 'tx_count' not in columns:
+                    conn.execute('DROP TABLE block_cache')  # cache files of older versions are simply rebuilt
+                conn.execute(BLOCK_CACHE_TABLE)
+            await self.db.transaction('block_cache_init', work)
+            self._ready = True
+        return self.db
+    
+    def _remember(self, number: int, block_hash: str, transactions: list):
+        previous = self._memory.get(number)
+        if previous is not None:
+            self._memory_txs -= len(previous[1])
+        self._memory[number] = (block_hash, transactions)
+        self._memory.move_to_end(number)
+        self._memory_txs += len(transactions)
+        while self._memory_txs > BLOCK_CACHE_MEMORY_TXS and len(self._memory) > 1:
+            self._memory_txs -= len(self._memory.popitem(last=False)[1][1])
+    
+    async def get_many(self, block_numbers: list) -> Dict[int, list]:
+        """Return {block number: transactions} for the cached blocks among block_numbers"""
+        found = {}
+        missing = []
+        for number in block_numbers:
+            entry = self._memory.get(number)
+            if entry is None:
+                missing.append(number)
+            else:
+                self._memory.move_to_end(number)
+                found[number] = entry[1]
+        BLOCK_CACHE_LOOKUPS.inc(('memory',), len(found))
+        
+        if missing and self.db is not None:
+            db = await self._store()
+            rows = await db.fetchall(
+                'block_cache_get',
+                f'SELECT number, hash, txs FROM block_cache WHERE number IN ({",".join("?" * len(missing))})',
+                tuple(missing)
+            )
+            for number, block_hash, txs in rows:
+                transactions = [tuple(tx) for tx in json_loads(txs)]
+                self._remember(number, block_hash, transactions)
+                found[number] = transactions
+            BLOCK_CACHE_LOOKUPS.inc(('disk',), len(rows))
+        
+        BLOCK_CACHE_LOOKUPS.inc(('miss',), len(block_numbers) - len(found))
+        return found
+    
+    async def put_many(self, blocks: list):
+        """Cache (number, hash, parent hash, transactions) of freshly fetched blocks"""
+        reorged = []
+        for number, block_hash, parent_hash, transactions in blocks:
+            previous = self._memory.get(number - 1)
+            if previous is not None and previous[0] != parent_hash:
+                reorged.append(number)
+            self._remember(number, block_hash, transactions)
+        for number in reorged:
+            logger.warning("Parent of block %s changed, dropping cached blocks below it", number)
+            await self.invalidate(number - BLOCK_CACHE_REORG_DEPTH, number - 1)
+        
+        if self.db is None:
+            return
+        rows = [
+            (number, block_hash, len(transactions), json.dumps(transactions))
+            for number, block_hash, _, transactions in blocks
+        ]
+        
+        def work(conn):
+            conn.executemany('INSERT OR REPLACE INTO block_cache (number, hash, tx_count, txs) VALUES (?, ?, ?, ?)', rows)
+            if self._disk_txs is None:
+                self._disk_txs = conn.execute('SELECT COALESCE(SUM(tx_count), 0) FROM block_cache').fetchone()[0]
+            else:
+                self._disk_txs += sum(row[2] for row in rows)
+            if self._disk_txs > BLOCK_CACHE_MAX_TXS:
+                self._prune(conn)
+        db = await self._store()
+        await db.transaction('block_cache_put', work)
+    
+    def _prune(self, conn):
+        """Drop the oldest stored blocks down to 90% of BLOCK_CACHE_MAX_TXS, so this runs once per 10% of inserts"""
+        total = conn.execute('SELECT COALESCE(SUM(tx_count), 0) FROM block_cache').fetchone()[0]
+        excess = total - BLOCK_CACHE_MAX_TXS * 9 // 10
+        cutoff = None
+        oldest = conn.execute('SELECT number, tx_count FROM block_cache ORDER BY number')
+        for number, tx_count in oldest:
+            if excess <= 0:
+                break
+            excess -= tx_count
+            cutoff = number
+        oldest.close()
+        if cutoff is not None:
+            conn.execute('DELETE FROM block_cache WHERE number <= ?', (cutoff,))
+        self._disk_txs = conn.execute('SELECT COALESCE(SUM(tx_count), 0) FROM block_cache').fetchone()[0]
+    
+    async def invalidate(self, start_block: int, end_block: int):
+        """Drop cached blocks start_block..end_block"""
+        for number in [n for n in self._memory if start_block <= n <= end_block]:
+            self._memory_txs -= len(self._memory.pop(number)[1])
+        if self.db is not None:
+            db = await self._store()
+            await db.execute('block_cache_invalidate', 'DELETE FROM block_cache WHERE number BETWEEN ? AND ?', (start_block, end_block))
+    
+    async def close(self):
+        if self.db is not None:
+            await self.db.close()
+
+class TTLCache:
+    """Map with a size cap and one TTL for every entry.
+    
+    Entries are kept in insertion order, which is also expiry order, so
+    expired and overflowing entries are dropped from the front in O(1).
+    """
+    
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()  # key -> (expires_at, value)
+    
+    def _evict(self, now: float):
+        entries = self._entries
+        while entries and (len(entries) > self.max_size or next(iter(entries.values()))[0] <= now):
+            entries.popitem(last=False)
+    
+    def add(self, key, value=None) -> bool:
+        """Insert key unless it is already present, returning whether it was new"""
+        now = time.monotonic()
+        self._evict(now)
+        if key in self._entries:
+            return False
+        self._entries[key] = (now + self.ttl, value)
+        self._evict(now)
+        return True
+    
+    def pop(self, key, default=None):
+        entry = self._entries.pop(key, None)
+        if entry is None or entry[0] <= time.monotonic():
+            return default
+        return entry[1]
+    
+    def __contains__(self, key) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and entry[0] > time.monotonic()
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class PendingWatcher:
+    """Feeds mempool transactions to a callback (PENDING_WATCH).
+    
+    The source is eth_subscribe("newPendingTransactions", true) on WS_URL, or
+    polling txpool_content with PENDING_SOURCE=txpool (e.g. a local node).
+    Every hash is handled once: seen hashes stay in a TTLCache of at most
+    PENDING_MAX_HASHES entries, so a flooded mempool cannot grow memory.
+    """
+    
+    def __init__(self, monitor, on_transactions):
+        self.monitor = monitor
+        self.on_transactions = on_transactions  # async on_transactions(list of raw transaction dicts)
+        self.seen = TTLCache(PENDING_MAX_HASHES, PENDING_TTL)
+        self._hashes: asyncio.Queue = asyncio.Queue(maxsize=PENDING_MAX_HASHES)
+    
+    async def run(self):
+        if PENDING_SOURCE == "txpool":
+            await self._poll_txpool()
+        else:
+            fetcher = asyncio.create_task(self._fetch_hashes())
+            try:
+                await self._subscribe()
+            finally:
+                fetcher.cancel()
+    
+    async def _handle(self, transactions: list):
+        new = [tx for tx in transactions if tx and self.seen.add(tx['hash'])]
+        if new:
+            await self.on_transactions(new)
+    
+    async def _poll_txpool(self):
+        backoff = Backoff()
+        while True:
+            await self.monitor.wait_for_addresses()  # no polling while nothing is monitored
+            try:
+                content = await self.monitor.rpc("txpool_content", [])
+                await self._handle([
+                    tx for by_nonce in (content.get('pending') or {}).values() for tx in by_nonce.values()
+                ])
+                backoff.reset()
+                await asyncio.sleep(PENDING_POLL_INTERVAL)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("txpool_content poll failed: %s", e)
+                await backoff.sleep()
+    
+    async def _subscribe(self):
+        backoff = Backoff(cap=WS_RECONNECT_MAX)
+        while True:
+            await self.monitor.wait_for_addresses()  # no subscription while nothing is monitored
+            try:
+                async with aiohttp.ClientSession() as session:
+                    async with session.ws_connect(WS_URL, heartbeat=30) as ws:
+                        # true asks for full transaction objects; nodes without it send hashes
+                        await ws.send_json({"jsonrpc": "2.0", "id": 1, "method": "eth_subscribe",
+                                            "params": ["newPendingTransactions", True]})
+                        reply = await ws.receive_json(timeout=RPC_TIMEOUT)
+                        if 'error' in reply:
+                            raise RuntimeError(reply['error'])
+                        subscription_id = reply['result']
+                        backoff.reset()
+                        logger.info("📡 Watching pending transactions via %s", WS_URL)
+                        
+                        async for message in ws:
+                            if message.type != aiohttp.WSMsgType.TEXT or not self.monitor.monitored_addresses:
+                                break
+                            payload = json_loads(message.data)
+                            params = payload.get('params') or {}
+                            if payload.get('method') != 'eth_subscription' or params.get('subscription') != subscription_id:
+                                continue
+                            result = params['result']
+                            if isinstance(result, dict):
+                                await self._handle([result])
+                            elif result not in self.seen and not self._hashes.full():
+                                self._hashes.put_nowait(result)  # dropped when the fetcher cannot keep up
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Pending transaction subscription error (%s: %s)", type(e).__name__, e)
+            await backoff.sleep()
+    
+    async def _fetch_hashes(self):
+        """Resolve hash-only notifications in eth_getTransactionByHash batches"""
+        while True:
+            hashes = [await self._hashes.get()]
+            while len(hashes) < PENDING_FETCH_BATCH and not self._hashes.empty():
+                hashes.append(self._hashes.get_nowait())
+            try:
+                await self._handle(await self.monitor.rpc_batch(
+                    [("eth_getTransactionByHash", [tx_hash]) for tx_hash in hashes]
+                ))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Could not fetch %s pending transactions: %s", len(hashes), e)
+
+class HeadSubscriber:
+    """Tracks the chain head through an eth_subscribe("newHeads") WebSocket subscription.
+    
+    Reconnects with exponential backoff. While disconnected, `connected` is
+    False and callers fall back to polling. After a reconnect the next scan
+    starts from the saved cursor, so blocks missed in between are filled in.
+    While the monitor has no addresses the subscription is closed and not
+    reopened until one is registered.
+    """
+    
+    def __init__(self, url: str, monitor):
+        self.url = url
+        self.monitor = monitor
+        self.latest_head = 0  # 0 until a head arrives on the current connection
+        self.connected = False
+        self._new_head = asyncio.Event()
+    
+    async def run(self):
+        backoff = 1.0
+        while True:
+            if not self.monitor.monitored_addresses:
+                await self.monitor.wait_for_addresses()
+                backoff = 1.0
+                continue
+            try:
+                async with aiohttp.ClientSession() as session:
+                    async with session.ws_connect(self.url, heartbeat=30) as ws:
+                        await ws.send_json({"jsonrpc": "2.0", "id": 1, "method": "eth_subscribe", "params": ["newHeads"]})
+                        reply = await ws.receive_json(timeout=RPC_TIMEOUT)
+                        if 'error' in reply:
+                            raise RuntimeError(reply['error'])
+                        subscription_id = reply['result']
+                        
+                        self.connected = True
+                        backoff = 1.0
+                        logger.info("📡 Subscribed to new heads via %s", self.url)
+                        self._new_head.set()  # scan right away to fill any gap since the last connection
+                        
+                        async for message in ws:
+                            if message.type != aiohttp.WSMsgType.TEXT:
+                                break
+                            if not self.monitor.monitored_addresses:
+                                self.connected = False  # idle: unsubscribe until an address is registered
+                                break
+                            payload = json.loads(message.data)
+                            params = payload.get('params') or {}
+                            if payload.get('method') != 'eth_subscription' or params.get('subscription') != subscription_id:
+                                continue
+                            self.latest_head = max(self.latest_head, int(params['result']['number'], 16))
+                            self._new_head.set()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Head subscription error (%s: %s), falling back to polling", type(e).__name__, e)
+            finally:
+                self.connected = False
+                self.latest_head = 0
+            if not self.monitor.monitored_addresses:
+                continue  # closed for being idle, not because of an error
+            
+            await asyncio.sleep(backoff * random.uniform(0.5, 1.5))
+            backoff = min(backoff * 2, WS_RECONNECT_MAX)
+    
+    async def wait(self, timeout: float) -> bool:
+        """Wait for the next head notification, returning False on timeout"""
+        try:
+            await asyncio.wait_for(self._new_head.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._new_head.clear()
+
+class BlockTimeEstimator:
+    """Estimates the chain's block time from recent (monotonic time, head) observations.
+    
+    Heads can be seen several blocks apart (polling, catch-up), so the estimate
+    is the observed rate over the last BLOCK_TIME_SAMPLES head changes rather
+    than the gap between two of them.
+    """
+    
+    def __init__(self):
+        self._samples: deque = deque(maxlen=BLOCK_TIME_SAMPLES)
+    
+    def observe(self, head: int):
+        if not self._samples or head > self._samples[-1][1]:
+            self._samples.append((time.monotonic(), head))
+    
+    @property
+    def block_time(self) -> Optional[float]:
+        if len(self._samples) < 2:
+            return None
+        (first_time, first_head), (last_time, last_head) = self._samples[0], self._samples[-1]
+        return (last_time - first_time) / (last_head - first_head)
+    
+    def poll_delay(self) -> float:
+        """Seconds until the next head is due; once it is overdue, re-poll every quarter block time"""
+        block_time = self.block_time
+        if block_time is None:
+            return POLL_INTERVAL
+        due = self._samples[-1][0] + block_time - time.monotonic()
+        return min(POLL_MAX_INTERVAL, max(POLL_MIN_INTERVAL, due if due > 0 else block_time / 4))
+
+class Backoff:
+    """Exponential backoff with jitter for a retry loop, reset after a success"""
+    
+    def __init__(self, base: float = ERROR_BACKOFF_BASE, cap: float = ERROR_BACKOFF_MAX):
+        self.base = base
+        self.cap = cap
+        self.failures = 0
+    
+    def reset(self):
+        self.failures = 0
+    
+    async def sleep(self):
+        delay = min(self.cap, self.base * 2 ** self.failures) * random.uniform(0.5, 1.5)
+        self.failures += 1
+        await asyncio.sleep(delay)
+
+class RPCEndpoint:
+    """One node of the RPC pool with its EWMA latency, failure state and last reported head"""
+    __slots__ = ('url', 'latency', 'failures', 'down_until', 'head', 'behind')
+    
+    def __init__(self, url: str):
+        self.url = url
+        self.latency = 0.0  # seconds; 0 until measured, so new nodes get tried
+        self.failures = 0
+        self.down_until = 0.0
+        self.head = 0
+        self.behind = False  # trailing the best head by more than RPC_MAX_HEAD_LAG
+    
+    def record_success(self, elapsed: float):
+        self.latency = elapsed if not self.latency else self.latency + RPC_EWMA_ALPHA * (elapsed - self.latency)
+        self.failures = 0
+        self.down_until = 0.0
+    
+    def record_unfinished(self, elapsed: float):
+        """A request abandoned after elapsed seconds (a lost hedge): its latency was at least that"""
+        if elapsed > self.latency:
+            self.latency += RPC_EWMA_ALPHA * (elapsed - self.latency)
+    
+    def record_failure(self):
+        self.failures += 1
+        self.down_until = time.monotonic() + min(RPC_DOWN_TIME * 2 ** (self.failures - 1), 300)
+    
+    def is_healthy(self, now: float) -> bool:
+        return now >= self.down_until and not self.behind
+
+class RPCPool:
+    """Routes calls to the fastest healthy node of RPC_URLS"""
+    
+    def __init__(self, urls: list):
+        self.endpoints = [RPCEndpoint(url) for url in urls]
+    
+    def ranked(self, tried: Set[str] = frozenset()) -> list:
+        """Endpoints in preference order: healthy by latency, then the rest by recovery time; tried ones last"""
+        now = time.monotonic()
+        healthy = sorted((e for e in self.endpoints if e.is_healthy(now)), key=lambda e: e.latency)
+        rest = sorted((e for e in self.endpoints if not e.is_healthy(now)), key=lambda e: e.down_until)
+        ordered = healthy + rest
+        return [e for e in ordered if e.url not in tried] + [e for e in ordered if e.url in tried]
+    
+    def update_heads(self):
+        """Mark nodes whose head trails the best head by more than RPC_MAX_HEAD_LAG"""
+        now = time.monotonic()
+        best = max((e.head for e in self.endpoints if now >= e.down_until), default=0)
+        for endpoint in self.endpoints:
+            behind = endpoint.head < best - RPC_MAX_HEAD_LAG
+            if behind != endpoint.behind:
+                if behind:
+                    logger.warning("RPC %s is %s blocks behind, skipping it", endpoint.url, best - endpoint.head)
+                else:
+                    logger.info("RPC %s caught up at block %s", endpoint.url, endpoint.head)
+            endpoint.behind = behind
+
+class PharosMonitor:
+    def __init__(self):
+        self.pool = RPCPool(RPC_URLS)
+        self._health_task: Optional[asyncio.Task] = None
+        self.block_cache = BlockCache(BLOCK_CACHE_PATH)
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.monitored_addresses = AddressIndex()
+        self.last_checked_block = 0
+        
+        self.token_info: Dict[str, tuple] = {}  # token address -> (symbol, decimals)
+        self._token_retries: list = []  # (start_block, end_block, failures) of token ranges to scan again
+        self.head_subscriber = HeadSubscriber(WS_URL, self) if WS_URL else None
+        self._head_task: Optional[asyncio.Task] = None
+        self.block_times = BlockTimeEstimator()
+        self.block_receipts_supported: Optional[bool] = None  # eth_getBlockReceipts, learned on first use
+        self._addresses_added = asyncio.Event()
+        BLOCK_TIME.set_function(lambda: self.block_times.block_time or 0)
+    
+    async def connect(self) -> bool:
+        """Open the pooled keep-alive HTTP session and check that at least one node is reachable"""
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=RPC_POOL_SIZE, keepalive_timeout=RPC_KEEPALIVE),
+                timeout=aiohttp.ClientTimeout(total=RPC_TIMEOUT)
+            )
+        await self.check_endpoints()
+        return any(endpoint.head for endpoint in self.pool.endpoints)
+    
+    async def check_endpoints(self):
+        """Probe every node's head and latency, and skip nodes that disagree with the best head"""
+        body = json.dumps({"jsonrpc": "2.0", "id": 0, "method": "eth_blockNumber", "params": []})
+        
+        async def check(endpoint: RPCEndpoint):
+            try:
+                reply = await self._send(endpoint, body)
+                endpoint.head = int(reply['result'], 16)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass  # already recorded as a failure
+            except Exception as e:
+                endpoint.record_failure()
+                logger.warning("RPC %s health check failed: %s", endpoint.url, e)
+            RPC_ENDPOINT_LATENCY.set(endpoint.latency, (endpoint.url,))
+            RPC_ENDPOINT_HEAD.set(endpoint.head, (endpoint.url,))
+        
+        await asyncio.gather(*(check(endpoint) for endpoint in self.pool.endpoints))
+        self.pool.update_heads()
+    
+    async def run_health_checks(self):
+        """Probe the nodes every RPC_HEALTH_INTERVAL, and not at all while no address is monitored"""
+        while True:
+            if not self.monitored_addresses:
+                await self.wait_for_addresses()
+                await self.check_endpoints()  # heads went stale while idle
+            await asyncio.sleep(RPC_HEALTH_INTERVAL)
+            if self.monitored_addresses:
+                await self.check_endpoints()
+    
+    def start_health_checks(self):
+        """Keep endpoint health and head agreement current when more than one node is configured"""
+        if len(self.pool.endpoints) > 1 and self._health_task is None:
+            self._health_task = asyncio.create_task(self.run_health_checks())
+    
+    def start_head_subscription(self):
+        """Start push-based head tracking if WS_URL is configured"""
+        if self.head_subscriber is not None and self._head_task is None:
+            self._head_task = asyncio.create_task(self.head_subscriber.run())
+    
+    async def wait_for_new_head(self):
+        """Sleep until a new head is pushed, or until the next head is due without a live subscription"""
+        if self.head_subscriber is None:
+            await asyncio.sleep(self.block_times.poll_delay())
+        else:
+            # Also wakes immediately when the subscription (re)connects
+            await self.head_subscriber.wait(
+                WS_STALE_TIMEOUT if self.head_subscriber.connected else self.block_times.poll_delay()
+            )
+    
+    def notify_addresses_added(self):
+        """Wake a scanner idling in wait_for_addresses"""
+        if self.monitored_addresses:
+            self._addresses_added.set()
+    
+    async def wait_for_addresses(self):
+        """Wait, without any RPC traffic, until at least one address is monitored"""
+        while not self.monitored_addresses:
+            self._addresses_added.clear()
+            await self._addresses_added.wait()
+    
+    async def close(self):
+        """Close the head subscription and the RPC session"""
+        if self._head_task is not None:
+            self._head_task.cancel()
+            self._head_task = None
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+        await self.block_cache.close()
+    
+    async def _send(self, endpoint: RPCEndpoint, body: str):
+        """POST a JSON-RPC body to one node, recording its latency or failure"""
+        started = time.perf_counter()
+        try:
+            async with self.session.post(endpoint.url, data=body, headers={'Content-Type': 'application/json'}) as response:
+                response.raise_for_status()
+                reply = json_loads(await response.read())
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            endpoint.record_failure()
+            raise
+        endpoint.record_success(time.perf_counter() - started)
+        return reply
+    
+    async def _hedged(self, body: str, primary: RPCEndpoint, backup: RPCEndpoint):
+        """Send body to primary, and also to backup if primary has not answered after RPC_HEDGE_AFTER.
+        
+        The losing request is cancelled but still counted as at least as slow
+        as it was, so a node that is slow on block batches loses its rank even
+        if it answers the eth_blockNumber health probes quickly.
+        """
+        started = time.perf_counter()
+        sends = {asyncio.ensure_future(self._send(primary, body)): (primary, started)}
+        try:
+            done, _ = await asyncio.wait(sends, timeout=RPC_HEDGE_AFTER)
+            if not done:
+                RPC_HEDGES.inc()
+                sends[asyncio.ensure_future(self._send(backup, body))] = (backup, time.perf_counter())
+            pending = set(sends)
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                if not pending:
+                    raise task.exception()
+        finally:
+            now = time.perf_counter()
+            for task, (endpoint, sent_at) in sends.items():
+                if not task.done():
+                    task.cancel()
+                    endpoint.record_unfinished(now - sent_at)
+    
+    async def _call_with_retry(self, description: str, body: str, hedge: bool = False):
+        """POST body to the best node, failing over to the next one on network errors.
+        
+        Backs off exponentially only once every node has been tried.
+        """
+        tried = set()
+        for attempt in range(RPC_MAX_RETRIES + 1):
+            endpoints = self.pool.ranked(tried)
+            try:
+                if hedge and RPC_HEDGE_AFTER > 0 and len(endpoints) > 1:
+                    return await self._hedged(body, endpoints[0], endpoints[1])
+                return await self._send(endpoints[0], body)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == RPC_MAX_RETRIES:
+                    raise
+                tried.add(endpoints[0].url)
+                if len(tried) < len(endpoints):
+                    logger.warning("RPC %s failed on %s (%s: %s), trying another node", description, endpoints[0].url, type(e).__name__, e)
+                    continue
+                tried.clear()
+                delay = RPC_RETRY_BACKOFF * (2 ** attempt)
+                logger.warning("RPC %s failed (%s: %s), retrying in %.1fs", description, type(e).__name__, e, delay)
+                await asyncio.sleep(delay)
+    
+    async def get_latest_block(self) -> int:
+        """Get the latest block number"""
+        # A live subscription already knows the head, no RPC round-trip needed
+        if self.head_subscriber is not None and self.head_subscriber.connected and self.head_subscriber.latest_head:
+            HEAD_BLOCK.set(self.head_subscriber.latest_head)
+            self.block_times.observe(self.head_subscriber.latest_head)
+            return self.head_subscriber.latest_head
+        
+        try:
+            latest = int(await self.rpc("eth_blockNumber", []), 16)
+            logger.debug("Latest block: %s", latest)
+            HEAD_BLOCK.set(latest)
+            self.block_times.observe(latest)
+            return latest
+        except Exception as e:
+            logger.error("Error getting latest block: %s", e)
+            return self.last_checked_block
+    
+    async def _post(self, method: str, payload, hedge: bool = False):
+        """POST a JSON-RPC payload through the endpoint pool and return the decoded reply"""
+        body = json.dumps(payload)
+        if isinstance(payload, list):
+            description, label = f"{method} batch of {len(payload)}", (f"batch:{method}",)
+        else:
+            description, label = method, (method,)
+        
+        with RPC_LATENCY.time(label):
+            try:
+                return await self._call_with_retry(description, body, hedge)
+            except Exception:
+                RPC_ERRORS.inc(label)
+                raise
+    
+    async def rpc(self, method: str, params: list):
+        """Raw JSON-RPC call returning the plain JSON result, bypassing web3's middleware and formatters"""
+        reply = await self._post(method, {"jsonrpc": "2.0", "id": 0, "method": method, "params": params})
+        if 'error' in reply:
+            RPC_ERRORS.inc((method,))
+            raise RPCError(method, reply['error'])
+        return reply.get('result')
+    
+    async def rpc_batch(self, calls: list, hedge: bool = False, return_errors: bool = False) -> list:
+        """Send (method, params) calls as one JSON-RPC batch and return their raw results in order.
+        
+        A failed call raises RPCError, or with return_errors takes the place of its result.
+        """
+        payload = [
+            {"jsonrpc": "2.0", "id": i, "method": method, "params": params}
+            for i, (method, params) in enumerate(calls)
+        ]
+        replies = await self._post(calls[0][0], payload, hedge)
+        if isinstance(replies, dict):
+            # Nodes without batch support answer with a single error object
+            raise RPCError(calls[0][0], replies.get('error', replies))
+        
+        by_id = {reply.get('id'): reply for reply in replies}
+        results = []
+        for i, (method, _) in enumerate(calls):
+            reply = by_id.get(i)
+            if reply is None or 'error' in reply:
+                error = RPCError(method, reply['error'] if reply else "missing reply in batch")
+                if not return_errors:
+                    raise error
+                results.append(error)
+                continue
+            results.append(reply.get('result'))
+        return results
+    
+    async def get_blocks(self, block_numbers: list) -> list:
+        """Return several blocks as compact transaction tuples, from the block cache or one JSON-RPC batch"""
+        try:
+            cached = await self.block_cache.get_many(block_numbers)
+        except Exception as e:
+            logger.warning("Block cache read failed: %s", e)
+            cached = {}
+        missing = [block_number for block_number in block_numbers if block_number not in cached]
+        if not missing:
+            return [cached[block_number] for block_number in block_numbers]
+        
+        blocks = await self.rpc_batch([
+            ("eth_getBlockByNumber", [hex(block_number), True]) for block_number in missing
+        ], hedge=True)
+        fetched = []
+        for block_number, block in zip(missing, blocks):
+            if block is None:
+                raise RPCError("eth_getBlockByNumber", f"block {block_number} not available yet")
+            transactions = decode_block_transactions(block)
+            cached[block_number] = transactions
+            fetched.append((block_number, block['hash'], block['parentHash'], transactions))
+        
+        try:
+            await self.block_cache.put_many(fetched)
+        except Exception as e:
+            logger.warning("Block cache write failed: %s", e)
+        return [cached[block_number] for block_number in block_numbers]
+    
+    def match_block(self, block_number: int, transactions: list) -> list:
+        """Return the transactions of a decoded block that involve monitored addresses.
+        
+        Only matched transactions pay for conversion (checksumming, wei to
+        PHRS); everything else is a pair of index lookups on the raw hex.
+        """
+        found_transactions = []
+        
+        for tx_hash, from_addr, to_addr, value, gas in transactions:
+            # O(1) lookups on both sides instead of scanning every monitored address
+            from_users = self.monitored_addresses.get(from_addr)
+            to_users = self.monitored_addresses.get(to_addr)
+            if not from_users and not to_users:
+                continue
+            
+            tx_info = {
+                'tx_hash': tx_hash,
+                'from': to_checksum_address(from_addr),
+                'to': to_checksum_address(to_addr) if to_addr else None,
+                'value': Decimal(int(value, 16)) / WEI_PER_PHRS,
+                'block_number': block_number,
+                'gas_limit': int(gas, 16),
+                'gas_used': None  # filled in from the receipt
+            }
+            found_transactions.extend(self._per_user_matches(tx_info, from_users, to_users))
+        
+        return found_transactions
+    
+    def match_pending(self, transactions: list) -> list:
+        """Return per-user entries for raw pending transactions that involve monitored addresses"""
+        found_transactions = []
+        for tx in transactions:
+            from_users = self.monitored_addresses.get(tx['from'])
+            to_users = self.monitored_addresses.get(tx.get('to'))
+            if not from_users and not to_users:
+                continue
+            
+            tx_info = {
+                'tx_hash': tx['hash'],
+                'from': to_checksum_address(tx['from']),
+                'to': to_checksum_address(tx['to']) if tx.get('to') else None,
+                'value': Decimal(int(tx['value'], 16)) / WEI_PER_PHRS,
+                'block_number': None,
+                'gas_limit': int(tx['gas'], 16),
+                'gas_used': None,
+                'pending': True
+            }
+            found_transactions.extend(self._per_user_matches(tx_info, from_users, to_users))
+        return found_transactions
+    
+    async def get_receipts(self, matches: list) -> Dict[str, dict]:
+        """Fetch the receipts behind matched entries, keyed by transaction hash.
+        
+        Blocks with at least RECEIPTS_BLOCK_MIN matched transactions take one
+        eth_getBlockReceipts call when the node supports it; all others take
+        one eth_getTransactionReceipt call per matched transaction, so the
+        cost follows the number of matches rather than block size. Calls go
+        out in JSON-RPC batches of at most RECEIPTS_BATCH_SIZE.
+        
+        Receipts are extra detail: a failed call or batch is logged and its
+        entries keep gas_used, fee and status unset, it never fails the scan.
+        Only a "method not found" answer turns eth_getBlockReceipts off.
+        """
+        by_block: Dict[int, set] = {}
+        for tx in matches:
+            by_block.setdefault(tx['block_number'], set()).add(tx['tx_hash'].split(':', 1)[0])  # token entries are hash:logIndex
+        
+        calls = []
+        for block_number, tx_hashes in by_block.items():
+            if self.block_receipts_supported is not False and len(tx_hashes) >= RECEIPTS_BLOCK_MIN:
+                calls.append(("eth_getBlockReceipts", [hex(block_number)]))
+            else:
+                calls.extend(("eth_getTransactionReceipt", [tx_hash]) for tx_hash in tx_hashes)
+        chunks = [calls[i:i + RECEIPTS_BATCH_SIZE] for i in range(0, len(calls), RECEIPTS_BATCH_SIZE)]
+        semaphore = asyncio.Semaphore(SCAN_CONCURRENCY)
+        
+        async def fetch(chunk: list) -> list:
+            async with semaphore:
+                try:
+                    return await self.rpc_batch(chunk, hedge=True, return_errors=True)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    # The whole batch failed; not an answer about any single method
+                    return [RPCError(chunk[0][0], f"batch of {len(chunk)} failed ({type(e).__name__}: {e})")] * len(chunk)
+        
+        receipts = {}
+        unsupported_blocks = set()
+        failed = []
+        for chunk, results in zip(chunks, await asyncio.gather(*(fetch(chunk) for chunk in chunks))):
+            for (method, params), result in zip(chunk, results):
+                if isinstance(result, RPCError):
+                    if method == "eth_getBlockReceipts" and result.method_not_found:
+                        unsupported_blocks.add(int(params[0], 16))
+                    else:
+                        failed.append(result)
+                    continue
+                if method == "eth_getBlockReceipts":
+                    self.block_receipts_supported = True
+                for receipt in result if isinstance(result, list) else (result,):
+                    if receipt:
+                        receipts[receipt['transactionHash']] = receipt
+        
+        if failed:
+            logger.warning("Could not fetch %s of %s receipt calls, gas and status stay unknown: %s", len(failed), len(calls), failed[0])
+        if unsupported_blocks:
+            if self.block_receipts_supported is None:
+                logger.info("eth_getBlockReceipts not available, using per-transaction receipts")
+            self.block_receipts_supported = False
+            receipts.update(await self.get_receipts([tx for tx in matches if tx['block_number'] in unsupported_blocks]))
+        return receipts
     
-    # Create users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            wallet_address TEXT UNIQUE,
-            last_block_checked INTEGER DEFAULT 0,
-            is_group_member BOOLEAN DEFAULT 0,
-            registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Create transactions table for tracking
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS tracked_transactions (
-            tx_hash TEXT PRIMARY KEY,
-            user_id INTEGER,
-            block_number INTEGER,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (user_id)
-        )
-    ''')
+    @staticmethod
+    def apply_receipts(matches: list, receipts: Dict[str, dict]):
+        """Set gas_used, fee (in PHRS) and status (1 success, 0 reverted) on matched entries"""
+        for tx in matches:
+            receipt = receipts.get(tx['tx_hash'].split(':', 1)[0])
+            if receipt is None:
+                continue
+            tx['gas_used'] = int(receipt['gasUsed'], 16)
+            gas_price = receipt.get('effectiveGasPrice')
+            tx['fee'] = Decimal(tx['gas_used'] * int(gas_price, 16)) / WEI_PER_PHRS if gas_price else None
+            tx['status'] = int(receipt.get('status') or '0x1', 16)
     
-    conn.commit()
-    conn.close()
-
-class PharosMonitor:
-    def __init__(self):
-        self.w3 = Web3(Web3.HTTPProvider(RPC_URL))
-        # For PoA networks, we can use the newer ExtraDataToPOAMiddleware or skip if not needed
-        try:
-            from web3.middleware import ExtraDataToPOAMiddleware
-            self.w3.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
-        except ImportError:
-            # If middleware is not available, continue without it
-            logger.warning("PoA middleware not available, continuing without it")
+    @staticmethod
+    def _per_user_matches(tx_info: dict, from_users: tuple, to_users: tuple) -> list:
+        """Fan a matched transfer out into one entry per subscribed user"""
+        matches = []
+        for user_id in from_users:
+            # Subscribed to both sides (a self-transfer, or two own wallets): notify once
+            matches.append({**tx_info, 'user_id': user_id, 'type': 'self' if user_id in to_users else 'outgoing'})
+        for user_id in to_users:
+            if user_id not in from_users:
+                matches.append({**tx_info, 'user_id': user_id, 'type': 'incoming'})
+        return matches
+    
+    async def get_token_info(self, token_address: str) -> tuple:
+        """Return (symbol, decimals) of an ERC-20 token, cached per token"""
+        info = self.token_info.get(token_address)
+        if info is not None:
+            return info
         
-        self.monitored_addresses: Dict[str, int] = {}  # address -> user_id
-        self.last_checked_block = 0
+        symbol, decimals = token_address[:10], 18
+        try:
+            raw = bytes.fromhex((await self.rpc("eth_call", [{'to': token_address, 'data': '0x313ce567'}, 'latest']))[2:])  # decimals()
+            decimals = int.from_bytes(raw[-32:], 'big') if raw else 18
+            raw = bytes.fromhex((await self.rpc("eth_call", [{'to': token_address, 'data': '0x95d89b41'}, 'latest']))[2:])  # symbol()
+            if len(raw) >= 96:
+                length = int.from_bytes(raw[32:64], 'big')
+                symbol = raw[64:64 + length].decode('utf-8', 'replace')
+            elif len(raw) == 32:
+                symbol = raw.rstrip(b'\0').decode('utf-8', 'replace')  # older bytes32 symbols
+        except Exception as e:
+            logger.warning("Could not read token metadata for %s: %s", token_address, e)
         
-    async def get_latest_block(self) -> int:
-        """Get the latest block number"""
+        # Symbols end up in Markdown messages, keep them to plain characters
+        symbol = ''.join(c for c in symbol if c.isalnum())[:12]
+        self.token_info[token_address] = info = (symbol or token_address[:10], decimals)
+        return info
+    
+    async def _get_logs(self, start_block: int, end_block: int, topics: list, splits: int = 0) -> list:
+        """eth_getLogs for a range, halving the range, then the address filter, when the provider rejects it"""
         try:
-            # Use async approach for better performance
-            latest = self.w3.eth.block_number
-            logger.debug(f"Latest block: {latest}")
-            return latest
+            return await self.rpc("eth_getLogs", [{'fromBlock': hex(start_block), 'toBlock': hex(end_block), 'topics': topics}])
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            raise
         except Exception as e:
-            logger.error(f"Error getting latest block: {e}")
-            return self.last_checked_block
+            if splits >= 12:
+                raise
+            if start_block < end_block:
+                middle = (start_block + end_block) // 2
+                logger.debug("eth_getLogs %s-%s rejected (%s), splitting the range", start_block, end_block, e)
+                return (await self._get_logs(start_block, middle, topics, splits + 1)
+                        + await self._get_logs(middle + 1, end_block, topics, splits + 1))
+            
+            # A single block still rejected: the address filter itself may be too large
+            position = len(topics) - 1  # the address list is the last topic
+            addresses = topics[position]
+            if len(addresses) < 2:
+                raise
+            half = len(addresses) // 2
+            logger.debug("eth_getLogs of block %s rejected (%s), splitting %s addresses", start_block, e, len(addresses))
+            return (await self._get_logs(start_block, end_block, [*topics[:position], addresses[:half]], splits + 1)
+                    + await self._get_logs(start_block, end_block, [*topics[:position], addresses[half:]], splits + 1))
+    
+    async def get_token_transfers(self, start_block: int, end_block: int) -> Dict[int, list]:
+        """Find ERC-20 transfers from or to monitored addresses, grouped by block number.
+        
+        The node does the filtering: monitored addresses go into topic positions
+        1 (from) and 2 (to) of Transfer log filters, split into LOGS_ADDRESS_CHUNK
+        addresses per filter and LOGS_BLOCK_RANGE blocks per query.
+        """
+        address_topics = ['0x' + '00' * 12 + key.hex() for key in self.monitored_addresses]
+        if not address_topics:
+            return {}
+        
+        queries = []
+        for first in range(start_block, end_block + 1, LOGS_BLOCK_RANGE):
+            last = min(first + LOGS_BLOCK_RANGE - 1, end_block)
+            for i in range(0, len(address_topics), LOGS_ADDRESS_CHUNK):
+                chunk = address_topics[i:i + LOGS_ADDRESS_CHUNK]
+                queries.append((first, last, [TRANSFER_TOPIC, chunk]))  # monitored sender
+                queries.append((first, last, [TRANSFER_TOPIC, None, chunk]))  # monitored recipient
+        
+        semaphore = asyncio.Semaphore(SCAN_CONCURRENCY)
+        
+        async def run_query(first, last, topics):
+            async with semaphore:
+                return await self._get_logs(first, last, topics)
+        
+        tasks = [asyncio.create_task(run_query(*query)) for query in queries]
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            # One failed query fails the range: don't leave the others running
+            for task in tasks:
+                task.cancel()
+            raise
+        
+        transfers: Dict[int, list] = {}
+        seen = set()
+        for log in (log for logs in results for log in logs):
+            # ERC-721 uses the same event signature but indexes the token id as a 4th topic
+            if len(log['topics']) != 3 or log.get('removed'):
+                continue
+            log_id = (log['transactionHash'], log['logIndex'])  # raw hex strings
+            if log_id in seen:
+                continue  # both sides monitored, returned by both queries
+            seen.add(log_id)
+            
+            from_addr = '0x' + log['topics'][1][-40:]
+            to_addr = '0x' + log['topics'][2][-40:]
+            from_users = self.monitored_addresses.get(from_addr)
+            to_users = self.monitored_addresses.get(to_addr)
+            if not from_users and not to_users:
+                continue
+            
+            token_address = to_checksum_address(log['address'])
+            block_number = int(log['blockNumber'], 16)
+            symbol, decimals = await self.get_token_info(token_address)
+            amount = int(log['data'][2:66] or '0', 16)
+            tx_info = {
+                'tx_hash': f"{log['transactionHash']}:{int(log['logIndex'], 16)}",
+                'from': to_checksum_address(from_addr),
+                'to': to_checksum_address(to_addr),
+                'value': Decimal(amount) / (Decimal(10) ** decimals),
+                'token': symbol,
+                'token_address': token_address,
+                'block_number': block_number,
+                'gas_used': None
+            }
+            transfers.setdefault(block_number, []).extend(
+                self._per_user_matches(tx_info, from_users, to_users)
+            )
+        
+        return transfers
+    
+    async def scan_token_transfers(self, start_block: int, end_block: int) -> Dict[int, list]:
+        """get_token_transfers for a range plus earlier ranges that failed, without ever raising.
+        
+        Token scanning is opt-in and must not hold up native transfers or the
+        cursor: a failed range is logged and retried with the next pass, up to
+        LOGS_RETRY_ATTEMPTS passes. A pass spends at most LOGS_SCAN_TIMEOUT
+        seconds; the range running then fails, ranges not reached yet are
+        retried without counting a failure. Transfers found in a retried range
+        carry their own block numbers, below start_block.
+        """
+        ranges = [*self._token_retries, (start_block, end_block, 0)]
+        self._token_retries = []
+        transfers: Dict[int, list] = {}
+        deadline = time.monotonic() + LOGS_SCAN_TIMEOUT
+        for first, last, failures in ranges:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._token_retries.append((first, last, failures))
+                continue
+            try:
+                found = await asyncio.wait_for(self.get_token_transfers(first, last), remaining)
+                for block_number, entries in found.items():
+                    transfers.setdefault(block_number, []).extend(entries)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    e = f"no answer within {LOGS_SCAN_TIMEOUT:g}s"
+                RPC_ERRORS.inc(("token_scan",))
+                if failures + 1 < LOGS_RETRY_ATTEMPTS:
+                    logger.warning("ERC-20 transfer scan of blocks %s-%s failed, retrying with the next pass: %s", first, last, e)
+                    self._token_retries.append((first, last, failures + 1))
+                else:
+                    logger.error("ERC-20 transfer scan of blocks %s-%s failed %s times, skipping it: %s", first, last, failures + 1, e)
+        return transfers
     
     async def check_transactions_in_block(self, block_number: int) -> list:
         """Check for transactions involving monitored addresses in a specific block"""
-        found_transactions = []
+        try:
+            transactions = (await self.get_blocks([block_number]))[0]
+            return self.match_block(block_number, transactions)
+        except Exception as e:
+            logger.error("Error checking block %s: %s", block_number, e)
+            return []
+    
+    async def scan_range(self, start_block: int, end_block: int):
+        """Yield (block_number, transactions) for start_block..end_block in block order.
+        
+        Blocks are fetched in JSON-RPC batches with up to SCAN_CONCURRENCY
+        batches in flight, while matching stays sequential. Batches grow with
+        the range up to SCAN_BATCH_SIZE: a few blocks at the head are spread
+        over parallel requests, a long catch-up uses full batches. Receipts
+        are then fetched for the matched transactions of each batch only. A
+        failed batch raises, so the caller can resume from the last yielded block;
+        token transfers never do, see scan_token_transfers.
+        
+        Token transfers are fetched alongside and never waited for by a batch:
+        once they arrive they go out with the next yielded block, those of
+        blocks already yielded included. If they arrive after the last batch,
+        they are yielded once more under end_block.
+        """
+        batch_size = max(1, min(SCAN_BATCH_SIZE, -(-(end_block - start_block + 1) // SCAN_CONCURRENCY)))
+        batches = [
+            list(range(first, min(first + batch_size, end_block + 1)))
+            for first in range(start_block, end_block + 1, batch_size)
+        ]
+        in_flight = deque()
+        next_batch = 0
+        
+        # Token transfers come from eth_getLogs for the whole range, fetched alongside the blocks
+        token_task = None
+        token_transfers: Optional[Dict[int, list]] = None
+        if SCAN_ERC20 and self.monitored_addresses:
+            token_task = asyncio.create_task(self.scan_token_transfers(start_block, end_block))
         
         try:
-            block = self.w3.eth.get_block(block_number, full_transactions=True)
-            
-            for tx in block.transactions:
-                # Check if transaction involves any monitored address
-                from_addr = tx['from'].lower() if tx['from'] else None
-                to_addr = tx['to'].lower() if tx['to'] else None
+            while next_batch < len(batches) or in_flight:
+                # Keep the fetch window full
+                while next_batch < len(batches) and len(in_flight) < SCAN_CONCURRENCY:
+                    numbers = batches[next_batch]
+                    in_flight.append((numbers, asyncio.create_task(self.get_blocks(numbers))))
+                    next_batch += 1
                 
-                for monitored_addr, user_id in self.monitored_addresses.items():
-                    monitored_addr_lower = monitored_addr.lower()
-                    
-                    if from_addr == monitored_addr_lower or to_addr == monitored_addr_lower:
-                        tx_type = "outgoing" if from_addr == monitored_addr_lower else "incoming"
-                        
-                        found_transactions.append({
-                            'user_id': user_id,
-                            'tx_hash': tx['hash'].hex(),
-                            'from': tx['from'],
-                            'to': tx['to'],
-                            'value': self.w3.from_wei(tx['value'], 'ether'),
-                            'type': tx_type,
-                            'block_number': block_number,
-                            'gas_used': tx['gas']
-                        })
-                        
-        except Exception as e:
-            logger.error(f"Error checking block {block_number}: {e}")
+                numbers, task = in_flight.popleft()
+                blocks = await task
+                if token_task is not None and token_transfers is None and token_task.done():
+                    token_transfers = token_task.result()
+                matched = [self.match_block(block_number, block) for block_number, block in zip(numbers, blocks)]
+                if token_transfers:
+                    # Transfers of earlier blocks (yielded already, or of retried ranges) go out with the first one
+                    for number in [number for number in token_transfers if number <= numbers[-1]]:
+                        matched[max(0, number - numbers[0])] += token_transfers.pop(number)
+                entries = [tx for block_matches in matched for tx in block_matches]
+                if FETCH_RECEIPTS and entries:
+                    self.apply_receipts(entries, await self.get_receipts(entries))
+                for block_number, block_matches in zip(numbers, matched):
+                    yield block_number, block_matches
             
-        return found_transactions
+            if token_task is not None and token_transfers is None:
+                entries = [tx for block_entries in (await token_task).values() for tx in block_entries]
+                if entries:
+                    if FETCH_RECEIPTS:
+                        self.apply_receipts(entries, await self.get_receipts(entries))
+                    yield end_block, entries
+        finally:
+            for _, task in in_flight:
+                task.cancel()
+            if token_task is not None:
+                token_task.cancel()
+
+class TokenBucket:
+    """Token bucket rate limiter for a single asyncio loop"""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+    
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+    
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+    
+    async def acquire(self):
+        """Wait until a token is available and take it"""
+        while True:
+            now = time.monotonic()
+            self._refill(now)
+            if self.tokens >= 1 and now >= self.updated:
+                self.tokens -= 1
+                return
+            wait = max(self.updated - now, (1 - self.tokens) / self.rate)
+            await asyncio.sleep(wait)
+    
+    def pause(self, seconds: float):
+        """Hold the bucket at a single token until the given time has passed (e.g. after a 429)"""
+        self.tokens = 1.0
+        self.updated = max(self.updated, time.monotonic() + seconds)
+    
+    def is_idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+class NotificationDispatcher:
+    """Delivers notifications off the scan loop.
+    
+    Events are collected per chat for DIGEST_WINDOW seconds and handed to
+    worker tasks as one batch, so a burst for the same user becomes a single
+    digest message. Workers respect a global and a per-chat token bucket and
+    back off on RetryAfter, so a slow or throttled Telegram API never stalls
+    block scanning. Edits of already delivered messages share the same queue
+    and rate limits.
+    """
+    
+    def __init__(self, send, render, edit=None, delivered=None, settled=None):
+        self.send = send  # async send(chat_id, text) -> Message
+        self.render = render  # render(events) -> text
+        self.edit = edit  # async edit(chat_id, message_id, text)
+        self.delivered = delivered  # delivered(chat_id, events, text, message), after a successful send
+        self.settled = settled  # settled(events), once delivered or given up on; never for events dropped by stop()
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._pending: Dict[int, list] = {}  # chat_id -> events waiting to be delivered
+        self._workers: list = []
+        self._global_bucket = TokenBucket(NOTIFY_GLOBAL_RATE)
+        self._chat_rate = NOTIFY_CHAT_RATE
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+    
+    def start(self):
+        for _ in range(NOTIFY_WORKERS):
+            self._workers.append(asyncio.create_task(self._worker()))
+    
+    def submit(self, chat_id: int, event: dict):
+        """Queue an event for chat_id without waiting for delivery"""
+        NOTIFY_QUEUE_DEPTH.inc()
+        events = self._pending.get(chat_id)
+        if events is not None:
+            events.append(event)  # merged into the message already scheduled for this chat
+            return
+        
+        self._pending[chat_id] = [event]
+        if DIGEST_WINDOW > 0:
+            asyncio.get_running_loop().call_later(DIGEST_WINDOW, self._queue.put_nowait, chat_id)
+        else:
+            self._queue.put_nowait(chat_id)
+    
+    def submit_edit(self, chat_id: int, message_id: int, events: list):
+        """Queue a re-render of the events of a delivered message, edited in place"""
+        self._queue.put_nowait((chat_id, message_id, events))
+    
+    def queue_depth(self) -> int:
+        return sum(len(events) for events in self._pending.values())
+    
+    def set_share(self, processes: int):
+        """Split the global and per-chat rate limits evenly between this many sending processes"""
+        processes = max(1, processes)
+        self._global_bucket.rate = NOTIFY_GLOBAL_RATE / processes
+        self._global_bucket.capacity = max(1.0, self._global_bucket.rate)
+        self._global_bucket.tokens = min(self._global_bucket.tokens, self._global_bucket.capacity)
+        self._chat_rate = NOTIFY_CHAT_RATE / processes
+        for bucket in self._chat_buckets.values():
+            bucket.rate = self._chat_rate
+    
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10000:
+                # Forget chats whose bucket has fully refilled
+                now = time.monotonic()
+                self._chat_buckets = {c: b for c, b in self._chat_buckets.items() if not b.is_idle(now)}
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self._chat_rate, capacity=1)
+        return bucket
+    
+    async def _worker(self):
+        while True:
+            item = await self._queue.get()
+            try:
+                if isinstance(item, tuple):
+                    await self._edit(*item)
+                else:
+                    await self._deliver(item)
+            except Exception as e:
+                logger.error("Error sending notification to user %s: %s", item[0] if isinstance(item, tuple) else item, e)
+            finally:
+                self._queue.task_done()
+    
+    async def _deliver(self, chat_id: int):
+        chat_bucket = self._chat_bucket(chat_id)
+        await chat_bucket.acquire()
+        
+        # Anything that arrived while waiting for the chat's turn goes out in the same message
+        events = self._pending.pop(chat_id, None)
+        if not events:
+            return
+        NOTIFY_QUEUE_DEPTH.inc(amount=-len(events))
+        try:
+            await self._send(chat_id, chat_bucket, events)
+        except asyncio.CancelledError:
+            raise  # cut off by stop(): not settled, so the block is scanned and notified again after a restart
+        except Exception:
+            self._settle(events)
+            raise
+        self._settle(events)
+    
+    def _settle(self, events: list):
+        if self.settled is not None:
+            self.settled(events)
+    
+    async def _send(self, chat_id: int, chat_bucket: TokenBucket, events: list):
+        text = self.render(events)
+        for attempt in range(1, NOTIFY_MAX_ATTEMPTS + 1):
+            await self._global_bucket.acquire()
+            try:
+                with NOTIFY_LATENCY.time():
+                    message = await self.send(chat_id, text)
+                NOTIFY_SENT.inc(("sent",))
+                if self.delivered is not None:
+                    self.delivered(chat_id, events, text, message)
+                return
+            except RetryAfter as e:
+                NOTIFY_RETRY_AFTER.inc()
+                logger.warning("Telegram flood limit hit for user %s, retrying in %ss", chat_id, e.retry_after)
+                chat_bucket.pause(e.retry_after)
+                self._global_bucket.pause(e.retry_after)
+                if attempt < NOTIFY_MAX_ATTEMPTS:
+                    await chat_bucket.acquire()
+            except Forbidden as e:
+                NOTIFY_SENT.inc(("forbidden",))
+                logger.info("User %s cannot receive messages: %s", chat_id, e)
+                return
+            except BadRequest as e:
+                # A NetworkError subclass in PTB, but permanent (chat not found, unparsable text): never retried
+                NOTIFY_SENT.inc(("rejected",))
+                logger.warning("Telegram rejected the notification for user %s: %s", chat_id, e)
+                return
+            except (TimedOut, NetworkError):
+                if attempt == NOTIFY_MAX_ATTEMPTS:
+                    NOTIFY_SENT.inc(("failed",))
+                    raise
+                await asyncio.sleep(min(30, 2 ** attempt))
+        
+        # Every attempt hit the flood limit
+        NOTIFY_SENT.inc(("failed",))
+        logger.error("Dropping notification for user %s after %s flood limit responses", chat_id, NOTIFY_MAX_ATTEMPTS)
+    
+    async def _edit(self, chat_id: int, message_id: int, events: list):
+        chat_bucket = self._chat_bucket(chat_id)
+        await chat_bucket.acquire()
+        await self._global_bucket.acquire()
+        try:
+            await self.edit(chat_id, message_id, self.render(events))
+            NOTIFY_SENT.inc(("edited",))
+        except RetryAfter as e:
+            # Rare for edits; wait it out once and give up on a second refusal
+            NOTIFY_RETRY_AFTER.inc()
+            chat_bucket.pause(e.retry_after)
+            self._global_bucket.pause(e.retry_after)
+            await chat_bucket.acquire()
+            await self._global_bucket.acquire()
+            await self.edit(chat_id, message_id, self.render(events))
+            NOTIFY_SENT.inc(("edited",))
+        except BadRequest as e:
+            # e.g. the message was deleted or already shows this text
+            logger.info("Could not edit message %s for user %s: %s", message_id, chat_id, e)
+    
+    async def stop(self, timeout: float = 10):
+        """Deliver everything still pending, then stop the workers"""
+        for chat_id in list(self._pending):
+            self._queue.put_nowait(chat_id)
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Dropping %s undelivered notifications on shutdown", self.queue_depth())
+        for worker in self._workers:
+            worker.cancel()
+        self._workers.clear()
+
+class MembershipCache:
+    """TTL cache of group membership.
+    
+    Warmed from the persisted is_group_member column and kept current by
+    chat_member updates, so most /register calls need no get_chat_member
+    round-trip. Negative results expire sooner so a user who just joined is
+    rechecked quickly even if the join update was missed.
+    """
+    
+    def __init__(self):
+        self._entries: Dict[int, tuple] = {}  # user_id -> (is_member, expires_at)
+    
+    def get(self, user_id: int) -> Optional[bool]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        if entry[1] < time.monotonic():
+            del self._entries[user_id]
+            return None
+        return entry[0]
+    
+    def set(self, user_id: int, is_member: bool):
+        ttl = MEMBERSHIP_TTL if is_member else MEMBERSHIP_NEGATIVE_TTL
+        self._entries[user_id] = (is_member, time.monotonic() + ttl)
+    
+    def warm(self, member_ids: list):
+        for user_id in member_ids:
+            self.set(user_id, True)
+    
+    def __len__(self) -> int:
+        return len(self._entries)
 
 class TelegramBot:
     def __init__(self):
         self.application = None
+        self.db = Database()
+        self.tracked_buffer = TrackedTransactionBuffer(self.db)
+        self.dispatcher = NotificationDispatcher(
+            self.send_message, self.format_notification, edit=self.edit_message,
+            delivered=self.alert_delivered, settled=self.notification_settled
+        )
+        # (tx_hash, user_id) -> event of a provisional alert, until the transaction is mined
+        self.pending_alerts = TTLCache(PENDING_MAX_HASHES, PENDING_TTL)
+        self.membership = MembershipCache()
         self.pharos_monitor = PharosMonitor()
+        self.active_lease: Optional[int] = None  # start block of the lease being scanned (BOT_ROLE=scanner)
+        SCANNED_BLOCK.set_function(lambda: self.pharos_monitor.last_checked_block)
         
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /start command"""
@@ -156,12 +2418,13 @@ class TelegramBot:
             "*Syarat penggunaan:*\n"
             "1. Anda harus bergabung dengan grup kami terlebih dahulu\n"
             "2. Setelah bergabung, Anda dapat mendaftarkan alamat wallet\n"
-            "3. Alamat wallet bisa diganti kapan saja dengan register ulang\n"
+            f"3. Anda bisa mendaftarkan hingga {MAX_WALLETS_PER_USER} alamat wallet\n"
             "4. Bot akan mengirim notifikasi real-time untuk setiap transaksi\n\n"
             "*Perintah yang tersedia:*\n"
             "• `/register 0x....address kamu` - Daftarkan alamat wallet\n"
             "• `/status` - Lihat status pendaftaran\n"
-            "• `/unregister` - Hapus alamat wallet yang terdaftar\n"
+            "• `/history` - Lihat riwayat transaksi\n"
+            "• `/unregister [alamat]` - Hapus satu alamat wallet, atau semua jika tanpa alamat\n"
             "• `/help` - Bantuan\n\n"
             "Silakan bergabung dengan grup kami terlebih dahulu!"
         )
@@ -173,7 +2436,7 @@ class TelegramBot:
         await update.message.reply_text(welcome_text, parse_mode='Markdown', reply_markup=reply_markup)
         
         # Store user info
-        self.store_user_info(user_id, username)
+        await self.store_user_info(user_id, username)
     
     async def register_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle wallet registration"""
@@ -209,19 +2472,13 @@ class TelegramBot:
             return
         
         # Register wallet
-        success, status = self.register_wallet(user_id, wallet_address)
+        success, status = await self.register_wallet(user_id, wallet_address)
         
         if success:
-            self.pharos_monitor.monitored_addresses[wallet_address] = user_id
-            
-            if status == "replaced":
+            if status == "exists":
                 await update.message.reply_text(
-                    f"✅ Alamat wallet berhasil diperbarui!\n"
-                    f"👤 User: {username}\n"
-                    f"📍 Alamat Baru: `{wallet_address}`\n"
-                    f"🔗 Explorer: {EXPLORER_URL}address/{wallet_address}\n\n"
-                    "🔄 Monitoring alamat lama telah dihentikan.\n"
-                    "Bot sekarang akan memantau alamat baru secara real-time!",
+                    f"ℹ️ Alamat wallet ini sudah terdaftar di akun Anda.\n"
+                    f"📍 Alamat: `{wallet_address}`",
                     parse_mode='Markdown'
                 )
             else:
@@ -234,10 +2491,10 @@ class TelegramBot:
                     parse_mode='Markdown'
                 )
         else:
-            if status == "wallet_taken":
+            if status == "limit":
                 await update.message.reply_text(
-                    "❌ Alamat wallet ini sudah didaftarkan oleh pengguna lain!\n"
-                    "Setiap alamat wallet hanya bisa digunakan oleh satu pengguna."
+                    f"❌ Anda sudah mendaftarkan {MAX_WALLETS_PER_USER} alamat wallet (batas maksimum).\n"
+                    "Hapus salah satu dengan /unregister <alamat_wallet> terlebih dahulu."
                 )
             else:
                 await update.message.reply_text(
@@ -268,19 +2525,13 @@ class TelegramBot:
             return
         
         # Force register wallet
-        success, status = self.register_wallet(user_id, wallet_address)
+        success, status = await self.register_wallet(user_id, wallet_address)
         
         if success:
-            self.pharos_monitor.monitored_addresses[wallet_address] = user_id
-            
-            if status == "replaced":
+            if status == "exists":
                 await update.message.reply_text(
-                    f"✅ Alamat wallet berhasil diperbarui (force register)!\n"
-                    f"👤 User: {username}\n"
-                    f"📍 Alamat Baru: `{wallet_address}`\n"
-                    f"🔗 Explorer: {EXPLORER_URL}address/{wallet_address}\n\n"
-                    "🔄 Monitoring alamat lama telah dihentikan.\n"
-                    "Bot sekarang akan memantau alamat baru secara real-time!",
+                    f"ℹ️ Alamat wallet ini sudah terdaftar di akun Anda.\n"
+                    f"📍 Alamat: `{wallet_address}`",
                     parse_mode='Markdown'
                 )
             else:
@@ -293,10 +2544,10 @@ class TelegramBot:
                     parse_mode='Markdown'
                 )
         else:
-            if status == "wallet_taken":
+            if status == "limit":
                 await update.message.reply_text(
-                    "❌ Alamat wallet ini sudah didaftarkan oleh pengguna lain!\n"
-                    "Setiap alamat wallet hanya bisa digunakan oleh satu pengguna."
+                    f"❌ Anda sudah mendaftarkan {MAX_WALLETS_PER_USER} alamat wallet (batas maksimum).\n"
+                    "Hapus salah satu dengan /unregister <alamat_wallet> terlebih dahulu."
                 )
             else:
                 await update.message.reply_text(
@@ -307,61 +2558,117 @@ class TelegramBot:
         """Show user registration status"""
         user_id = update.effective_user.id
         
-        conn = sqlite3.connect('pharos_bot.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT wallet_address, is_group_member, registered_at FROM users WHERE user_id = ?', (user_id,))
-        result = cursor.fetchone()
-        conn.close()
+        result = await self.db.get_user_status(user_id)
         
         if not result:
             await update.message.reply_text("❌ Anda belum terdaftar. Gunakan /start untuk memulai.")
             return
         
-        wallet_address, is_group_member, registered_at = result
+        is_group_member, registered_at, monitoring_paused = result
+        wallets = await self.db.get_wallets(user_id)
         
         status_text = f"📊 *Status Pendaftaran Anda:*\n\n"
         status_text += f"👤 User ID: `{user_id}`\n"
         status_text += f"👥 Member Grup: {'✅ Ya' if is_group_member else '❌ Tidak'}\n"
         
-        if wallet_address:
-            status_text += f"💼 Wallet: `{wallet_address}`\n"
-            status_text += f"🔗 Explorer: {EXPLORER_URL}address/{wallet_address}\n"
+        if wallets:
+            status_text += f"💼 Wallet ({len(wallets)}/{MAX_WALLETS_PER_USER}):\n"
+            for wallet_address in wallets:
+                active = user_id in self.pharos_monitor.monitored_addresses.get(wallet_address)
+                status_text += f"{'🟢' if active else '🔴'} `{to_checksum_address(wallet_address)}`\n"
             status_text += f"📅 Terdaftar: {registered_at}\n"
-            status_text += f"🔄 Status Monitoring: {'🟢 Aktif' if wallet_address in self.pharos_monitor.monitored_addresses else '🔴 Tidak Aktif'}"
+            status_text += f"🔄 Status Monitoring: {'🔴 Dijeda' if monitoring_paused else '🟢 Aktif'}"
         else:
             status_text += "💼 Wallet: Belum didaftarkan"
         
         await update.message.reply_text(status_text, parse_mode='Markdown')
     
     async def unregister_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Unregister wallet address"""
+        """Unregister one wallet address, or all of them without an argument"""
         user_id = update.effective_user.id
         
-        conn = sqlite3.connect('pharos_bot.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT wallet_address FROM users WHERE user_id = ?', (user_id,))
-        result = cursor.fetchone()
-        
-        if not result or not result[0]:
-            await update.message.reply_text("❌ Anda tidak memiliki alamat wallet yang terdaftar.")
-            conn.close()
+        if context.args:
+            wallet_address = context.args[0]
+            if not self.is_valid_address(wallet_address):
+                await update.message.reply_text("❌ Alamat wallet tidak valid!")
+                return
+            
+            if not await self.db.remove_subscription(user_id, wallet_address):
+                await update.message.reply_text("❌ Alamat wallet ini tidak terdaftar di akun Anda.")
+                return
+            
+            self.pharos_monitor.monitored_addresses.remove(wallet_address, user_id)
+            await update.message.reply_text(
+                f"✅ Alamat wallet `{wallet_address}` berhasil dihapus dari monitoring!"
+            )
             return
         
-        wallet_address = result[0]
-        
         # Remove from database
-        cursor.execute('UPDATE users SET wallet_address = NULL WHERE user_id = ?', (user_id,))
-        conn.commit()
-        conn.close()
+        wallets = await self.db.clear_subscriptions(user_id)
+        
+        if not wallets:
+            await update.message.reply_text("❌ Anda tidak memiliki alamat wallet yang terdaftar.")
+            return
         
         # Remove from monitoring
-        if wallet_address in self.pharos_monitor.monitored_addresses:
-            del self.pharos_monitor.monitored_addresses[wallet_address]
+        for wallet_address in wallets:
+            self.pharos_monitor.monitored_addresses.remove(wallet_address, user_id)
         
         await update.message.reply_text(
-            f"✅ Alamat wallet `{wallet_address}` berhasil dihapus dari monitoring!"
+            f"✅ {len(wallets)} alamat wallet berhasil dihapus dari monitoring!"
+        )
+    
+    async def history_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Show the newest page of the user's notified transactions"""
+        text, reply_markup = await self.render_history(update.effective_user.id)
+        await update.message.reply_text(
+            text, parse_mode='Markdown', reply_markup=reply_markup, disable_web_page_preview=True
+        )
+    
+    async def history_page_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Replace a /history message with the older page named in the button data"""
+        query = update.callback_query
+        await query.answer()
+        try:
+            before_block = int(query.data.split(':', 1)[1])
+        except ValueError:
+            return
+        text, reply_markup = await self.render_history(query.from_user.id, before_block)
+        await query.edit_message_text(
+            text, parse_mode='Markdown', reply_markup=reply_markup, disable_web_page_preview=True
         )
     
+    async def render_history(self, user_id: int, before_block: Optional[int] = None) -> tuple:
+        """Render one /history page straight from tracked_transactions, returning (text, reply_markup)"""
+        rows, has_more = await self.db.load_history(user_id, before_block)
+        if not rows:
+            if before_block is None:
+                return "📭 Belum ada transaksi yang tercatat untuk wallet Anda.", None
+            return "📭 Tidak ada transaksi yang lebih lama.", None
+        
+        lines = ["📜 *Riwayat Transaksi*\n"]
+        for block_number, direction, counterparty, value, token, tx_hash in rows[:HISTORY_PAGE_SIZE * 2]:
+            tx_link = f"[{tx_hash[:10]}…]({EXPLORER_URL}tx/{tx_hash.split(':', 1)[0]})"
+            if direction is None:
+                # Recorded before history details were stored
+                lines.append(f"🔹 Blok {block_number}: {tx_link}")
+                continue
+            tx_type_emoji, tx_type_text = TX_TYPE_LABELS.get(direction, ("📥", "Masuk"))
+            lines.append(
+                f"{tx_type_emoji} {tx_type_text}: *{Decimal(value):.6f} {token}* "
+                f"({'dari' if direction == 'incoming' else 'ke'} `{counterparty}`)\n"
+                f"    Blok {block_number} · {tx_link}"
+            )
+        if len(rows) > HISTORY_PAGE_SIZE * 2:
+            lines.append(f"\n…dan {len(rows) - HISTORY_PAGE_SIZE * 2} transaksi lainnya di blok {rows[-1][0]}")
+        
+        reply_markup = None
+        if has_more:
+            reply_markup = InlineKeyboardMarkup([[
+                InlineKeyboardButton("⬅️ Lebih lama", callback_data=f"history:{rows[-1][0]}")
+            ]])
+        return "\n".join(lines), reply_markup
+    
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show help information"""
         help_text = (
@@ -370,7 +2677,8 @@ class TelegramBot:
             "• `/start` - Memulai bot dan melihat informasi\n"
             "• `/register <address>` - Mendaftarkan alamat wallet\n"
             "• `/status` - Melihat status pendaftaran\n"
-            "• `/unregister` - Menghapus alamat wallet\n"
+            "• `/history` - Melihat riwayat transaksi yang tercatat\n"
+            "• `/unregister [address]` - Menghapus satu atau semua alamat wallet\n"
             "• `/help` - Menampilkan bantuan ini\n\n"
             "*Informasi Jaringan:*\n"
             f"• Chain ID: {CHAIN_ID}\n"
@@ -378,177 +2686,461 @@ class TelegramBot:
             f"• Explorer: {EXPLORER_URL}\n\n"
             "*Catatan:*\n"
             "- Anda harus bergabung grup terlebih dahulu\n"
-            "- Alamat wallet bisa diganti kapan saja\n"
-            "- Setiap alamat hanya bisa digunakan oleh 1 user\n"
+            f"- Anda bisa memantau hingga {MAX_WALLETS_PER_USER} alamat wallet\n"
+            "- Satu alamat bisa dipantau oleh beberapa user\n"
             "- Notifikasi real-time untuk semua transaksi"
         )
         
         await update.message.reply_text(help_text, parse_mode='Markdown')
     
-    def store_user_info(self, user_id: int, username: str):
+    def timed_command(self, name: str, callback):
+        """Wrap a command handler so its latency is recorded per command"""
+        async def handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            with COMMAND_LATENCY.time((name,)):
+                return await callback(update, context)
+        return handler
+    
+    async def store_user_info(self, user_id: int, username: str):
         """Store user information in database"""
-        conn = sqlite3.connect('pharos_bot.db')
-        cursor = conn.cursor()
-        cursor.execute(
-            'INSERT OR IGNORE INTO users (user_id, username) VALUES (?, ?)',
-            (user_id, username)
-        )
-        conn.commit()
-        conn.close()
+        await self.db.store_user_info(user_id, username)
     
     async def check_group_membership(self, user_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool:
         """Check if user is member of the required group"""
+        cached = self.membership.get(user_id)
+        if cached is not None:
+            return cached
+        
         try:
-            logger.info(f"Checking membership for user {user_id} in group {GROUP_CHAT_ID}")
             chat_member = await context.bot.get_chat_member(GROUP_CHAT_ID, user_id)
+            logger.debug("User %s status in group %s: %s", user_id, GROUP_CHAT_ID, chat_member.status)
             
-            logger.info(f"User {user_id} status in group: {chat_member.status}")
-            
-            # Include 'restricted' status as well, since some groups have restrictions
-            is_member = chat_member.status in ['member', 'administrator', 'creator', 'restricted']
+            is_member = chat_member.status in MEMBER_STATUSES
+            self.membership.set(user_id, is_member)
             
             # Update database
-            conn = sqlite3.connect('pharos_bot.db')
-            cursor = conn.cursor()
-            cursor.execute('UPDATE users SET is_group_member = ? WHERE user_id = ?', (is_member, user_id))
-            conn.commit()
-            conn.close()
+            await self.db.set_group_member(user_id, is_member)
             
-            logger.info(f"User {user_id} membership status: {'✅ Member' if is_member else '❌ Not member'}")
+            logger.debug("User %s membership status: %s", user_id, '✅ Member' if is_member else '❌ Not member')
             return is_member
             
         except Exception as e:
-            logger.error(f"Error checking group membership for user {user_id}: {e}")
-            logger.error(f"Exception type: {type(e).__name__}")
+            logger.error("Error checking group membership for user %s (%s): %s", user_id, type(e).__name__, e)
             # In case of error, we'll assume they might be a member and let them try
             # This prevents false negatives due to API issues
             return True
     
+    async def chat_member_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Track joins and leaves in the group to keep the membership cache current"""
+        member_update = update.chat_member
+        chat = member_update.chat
+        if str(chat.id) != str(GROUP_CHAT_ID) and f"@{chat.username}" != str(GROUP_CHAT_ID):
+            return
+        
+        user_id = member_update.new_chat_member.user.id
+        was_member = member_update.old_chat_member.status in MEMBER_STATUSES
+        is_member = member_update.new_chat_member.status in MEMBER_STATUSES
+        
+        self.membership.set(user_id, is_member)
+        await self.db.set_group_member(user_id, is_member)
+        
+        if not PAUSE_ON_LEAVE or was_member == is_member:
+            return
+        
+        # Pause or resume the user's wallets in place; no rescan needed
+        wallets = await self.db.set_monitoring_paused(user_id, not is_member)
+        if not wallets:
+            return
+        for wallet_address in wallets:
+            if is_member:
+                self.pharos_monitor.monitored_addresses.add(wallet_address, user_id)
+            else:
+                self.pharos_monitor.monitored_addresses.remove(wallet_address, user_id)
+        self.pharos_monitor.notify_addresses_added()
+        logger.info("User %s %s the group, monitoring of %s wallets %s", user_id,
+                    'rejoined' if is_member else 'left', len(wallets), 'resumed' if is_member else 'paused')
+    
     def is_valid_address(self, address: str) -> bool:
         """Validate Ethereum address"""
         try:
-            return Web3.is_address(address)
+            return is_address(address)
         except:
             return False
     
-    def register_wallet(self, user_id: int, wallet_address: str) -> tuple[bool, str]:
-        """Register wallet address for user"""
+    async def register_wallet(self, user_id: int, wallet_address: str) -> tuple[bool, str]:
+        """Subscribe user to a wallet address, returning (success, status)"""
         try:
-            conn = sqlite3.connect('pharos_bot.db')
-            cursor = conn.cursor()
-            
-            # Check if wallet is already registered by another user
-            cursor.execute('SELECT user_id FROM users WHERE wallet_address = ? AND user_id != ?', 
-                         (wallet_address, user_id))
-            other_user = cursor.fetchone()
-            
-            if other_user:
-                conn.close()
-                return False, "wallet_taken"
-            
-            # Check if user already has a wallet registered
-            cursor.execute('SELECT wallet_address FROM users WHERE user_id = ?', (user_id,))
-            current_wallet = cursor.fetchone()
-            
-            # Remove old wallet from monitoring if exists
-            if current_wallet and current_wallet[0]:
-                old_wallet = current_wallet[0]
-                if old_wallet in self.pharos_monitor.monitored_addresses:
-                    del self.pharos_monitor.monitored_addresses[old_wallet]
-            
-            # Update with new wallet
-            cursor.execute('UPDATE users SET wallet_address = ? WHERE user_id = ?', 
-                         (wallet_address, user_id))
-            conn.commit()
-            conn.close()
+            status = await self.db.add_subscription(user_id, wallet_address)
+            if status == "limit":
+                return False, status
             
-            if current_wallet and current_wallet[0]:
-                return True, "replaced"
-            else:
-                return True, "new"
+            # Registering also resumes a paused user, so index all of their wallets
+            for wallet in await self.db.get_wallets(user_id):
+                self.pharos_monitor.monitored_addresses.add(wallet, user_id)
+            self.pharos_monitor.notify_addresses_added()
+            return True, status
                 
         except Exception as e:
-            logger.error(f"Error registering wallet: {e}")
+            logger.error("Error registering wallet: %s", e)
             return False, "error"
     
-    async def send_transaction_notification(self, user_id: int, tx_data: dict):
-        """Send transaction notification to user"""
-        try:
-            tx_type_emoji = "📤" if tx_data['type'] == "outgoing" else "📥"
-            tx_type_text = "Keluar" if tx_data['type'] == "outgoing" else "Masuk"
-            
-            notification_text = (
-                f"{tx_type_emoji} *Transaksi {tx_type_text} Terdeteksi!*\n\n"
-                f"💰 *Jumlah:* {tx_data['value']:.6f} PHRS\n"
-                f"📤 *Dari:* `{tx_data['from']}`\n\n"
-                f"📥 *Ke:* `{tx_data['to']}`\n"
+    def format_transaction_notification(self, tx_data: dict) -> str:
+        """Render the notification text for a single transaction"""
+        tx_type_emoji, tx_type_text = TX_TYPE_LABELS.get(tx_data['type'], ("📥", "Masuk"))
+        
+        # 'pending' is only set on alerts from the pending watch: True until mined, then False
+        pending = tx_data.get('pending')
+        if pending:
+            header = f"⏳ *Transaksi {tx_type_text} Tertunda (belum dikonfirmasi)*"
+        elif tx_data.get('status') == 0:
+            header = f"❌ *Transaksi {tx_type_text} Gagal (reverted)!*"
+        else:
+            header = f"{tx_type_emoji} *Transaksi {tx_type_text} Terdeteksi!*"
+        text = (
+            f"{header}\n\n"
+            f"💰 *Jumlah:* {tx_data['value']:.6f} {tx_data.get('token', 'PHRS')}\n"
+            f"📤 *Dari:* `{tx_data['from']}`\n\n"
+            f"📥 *Ke:* `{tx_data['to']}`\n"
+        )
+        # The sender pays the fee; receipts are only known once mined
+        if tx_data.get('fee') is not None and tx_data['type'] != "incoming":
+            text += f"⛽ *Biaya:* {tx_data['fee']:.6f} PHRS ({tx_data['gas_used']} gas)\n"
+        if pending is False:
+            text += f"\n✅ Terkonfirmasi di blok {tx_data['block_number']}"
+        return text
+    
+    def format_notification(self, events: list) -> str:
+        """Render one message for the events collected for a user, as a digest if there are several"""
+        if len(events) == 1:
+            return self.format_transaction_notification(events[0])
+        
+        lines = [f"🧾 *{len(events)} Transaksi Terdeteksi!*\n"]
+        for tx_data in events[:DIGEST_MAX_ITEMS]:
+            tx_type_emoji, tx_type_text = TX_TYPE_LABELS.get(tx_data['type'], ("📥", "Masuk"))
+            counterparty = tx_data['from'] if tx_data['type'] == "incoming" else tx_data['to']
+            status = {True: " ⏳", False: " ✅"}.get(tx_data.get('pending'), "")
+            if tx_data.get('status') == 0:
+                status = " ❌ gagal"
+            lines.append(
+                f"{tx_type_emoji} {tx_type_text}: *{tx_data['value']:.6f} {tx_data.get('token', 'PHRS')}* "
+                f"({'dari' if tx_data['type'] == 'incoming' else 'ke'} `{counterparty}`){status}"
             )
-            
-            await self.application.bot.send_message(
-                chat_id=user_id,
-                text=notification_text,
-                parse_mode='Markdown'
+        if len(events) > DIGEST_MAX_ITEMS:
+            lines.append(f"\n…dan {len(events) - DIGEST_MAX_ITEMS} transaksi lainnya")
+        return "\n".join(lines)
+    
+    async def send_message(self, chat_id: int, text: str):
+        """Send a Markdown message to a chat"""
+        return await self.application.bot.send_message(
+            chat_id=chat_id,
+            text=text,
+            parse_mode='Markdown'
+        )
+    
+    async def edit_message(self, chat_id: int, message_id: int, text: str):
+        """Replace the text of a message sent earlier"""
+        return await self.application.bot.edit_message_text(
+            text=text,
+            chat_id=chat_id,
+            message_id=message_id,
+            parse_mode='Markdown'
+        )
+    
+    async def on_pending_transactions(self, transactions: list):
+        """Send provisional alerts for mempool transactions of monitored addresses"""
+        matches = self.pharos_monitor.match_pending(transactions)
+        if not matches:
+            return
+        keys = {(tx['tx_hash'], tx['user_id']) for tx in matches}
+        # Mined and recorded already (the mempool can lag behind the scan)
+        done = {key for key in keys if key in self.tracked_buffer} | await self.db.filter_tracked(list(keys))
+        
+        for tx in matches:
+            key = (tx['tx_hash'], tx['user_id'])
+            if key in done or not self.pending_alerts.add(key, tx):
+                continue
+            PENDING_ALERTS.inc(("sent",))
+            self.dispatcher.submit(tx['user_id'], tx)
+    
+    def alert_delivered(self, chat_id: int, events: list, text: str, message):
+        """Remember the message carrying provisional alerts, so confirmations edit it"""
+        if message is None or not any('pending' in event for event in events):
+            return
+        for event in events:
+            event['message_id'] = message.message_id
+            event['message_events'] = events
+        # A transaction mined between rendering and sending is confirmed right away
+        if self.format_notification(events) != text:
+            self.dispatcher.submit_edit(chat_id, message.message_id, events)
+    
+    def notification_settled(self, events: list):
+        """Let the rows of notified transactions be written; they would suppress a re-scan's notification"""
+        for event in events:
+            event['settled'] = True  # a provisional alert mined later is recorded right away
+            self.tracked_buffer.release((event['tx_hash'], event['user_id']))
+    
+    async def start_webhook(self) -> web.AppRunner:
+        """Serve the Telegram webhook plus the keep-alive, health and metrics routes on this loop"""
+        async def home(request):
+            return web.Response(text="Pharos Bot is running!")
+        
+        async def metrics(request):
+            return web.Response(text=render_metrics(), headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+        
+        async def healthz(request):
+            text, status = health_status()
+            return web.Response(text=text, status=status)
+        
+        server = web.Application()
+        server.router.add_get('/', home)
+        server.router.add_get('/metrics', metrics)
+        server.router.add_get('/healthz', healthz)
+        server.router.add_post(WEBHOOK_PATH, self.webhook_update)
+        
+        runner = web.AppRunner(server, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, '0.0.0.0', WEB_PORT).start()
+        logger.info("🌐 Webhook server listening on port %s", WEB_PORT)
+        
+        try:
+            await self.application.bot.set_webhook(
+                url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES
             )
-            
         except Exception as e:
-            logger.error(f"Error sending notification to user {user_id}: {e}")
+            # The server keeps running, so recorded updates can still be POSTed locally
+            logger.error("Could not register the webhook with Telegram: %s", e)
+        return runner
+    
+    async def webhook_update(self, request: web.Request) -> web.Response:
+        """Accept one Update pushed by Telegram and hand it to the application's update queue"""
+        if not hmac.compare_digest(
+                request.headers.get('X-Telegram-Bot-Api-Secret-Token', ''), WEBHOOK_SECRET):
+            return web.Response(status=403)
+        try:
+            update = Update.de_json(await request.json(loads=json_loads), self.application.bot)
+        except Exception as e:
+            logger.warning("Rejected malformed webhook update: %s", e)
+            return web.Response(status=400)
+        
+        # Answer right away; handlers run from the queue like polled updates
+        await self.application.update_queue.put(update)
+        return web.Response()
     
-    def load_monitored_addresses(self):
+    async def load_monitored_addresses(self):
         """Load monitored addresses from database"""
-        conn = sqlite3.connect('pharos_bot.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT user_id, wallet_address FROM users WHERE wallet_address IS NOT NULL')
-        results = cursor.fetchall()
-        conn.close()
+        # Build a fresh index from the streamed rows and swap it in, so a
+        # scan running during a reload never sees a half-filled index
+        index = AddressIndex()
+        async for rows in self.db.iter_monitored_wallets():
+            for user_id, address in rows:
+                index.add_key(address, user_id)
         
-        for user_id, wallet_address in results:
-            self.pharos_monitor.monitored_addresses[wallet_address] = user_id
+        self.pharos_monitor.monitored_addresses = index
+        self.pharos_monitor.notify_addresses_added()
+    
+    async def process_block_matches(self, block_number: int, transactions: list):
+        """Notify and record matched transactions of one block, skipping ones already tracked"""
+        BLOCKS_SCANNED.inc()
+        
+        # Re-scanned blocks (restart, backfill retry) must not notify twice
+        already_tracked = set()
+        if transactions:
+            keys = {(tx['tx_hash'], tx['user_id']) for tx in transactions}
+            already_tracked = {key for key in keys if key in self.tracked_buffer}
+            if keys - already_tracked:
+                already_tracked |= await self.db.filter_tracked(list(keys - already_tracked))
+        
+        for tx in transactions:
+            if (tx['tx_hash'], tx['user_id']) in already_tracked:
+                continue
+            
+            MATCHED_TRANSACTIONS.inc((tx['type'],))
+            alert = self.pending_alerts.pop((tx['tx_hash'], tx['user_id']))
+            notified = alert is not None and alert.get('settled', False)
+            if alert is None:
+                self.dispatcher.submit(tx['user_id'], tx)
+            else:
+                # Confirm the provisional alert in place instead of sending a second message.
+                # Not delivered yet: the queued message simply renders it as confirmed.
+                PENDING_ALERTS.inc(("confirmed",))
+                alert.update({key: tx.get(key) for key in ('block_number', 'gas_used', 'fee', 'status')}, pending=False)
+                if 'message_id' in alert:
+                    self.dispatcher.submit_edit(tx['user_id'], alert['message_id'], alert['message_events'])
+            
+            # Queue the row; it is written together with the scan cursor once the user was notified
+            self.tracked_buffer.add(tx, held=not notified)
+        
+        if self.tracked_buffer.is_due():
+            try:
+                await self.tracked_buffer.flush()
+            except Exception as db_error:
+                logger.error("Database error: %s", db_error)
+    
+    async def backfill(self, start_block: int, end_block: int):
+        """Scan a large gap in parallel chunks, persisting the cursor as chunks complete in order"""
+        chunks = [
+            (first, min(first + BACKFILL_CHUNK_SIZE - 1, end_block))
+            for first in range(start_block, end_block + 1, BACKFILL_CHUNK_SIZE)
+        ]
+        logger.info("⏪ Backfilling blocks %s to %s in %s chunks", start_block, end_block, len(chunks))
+        
+        semaphore = asyncio.Semaphore(BACKFILL_WORKERS)
+        completed = set()
+        next_chunk = 0  # first chunk not yet covered by the saved cursor
+        
+        async def scan_chunk(index: int, first: int, last: int):
+            nonlocal next_chunk
+            async with semaphore:
+                async with aclosing(self.pharos_monitor.scan_range(first, last)) as blocks:
+                    async for block_num, transactions in blocks:
+                        await self.process_block_matches(block_num, transactions)
+            
+            # Only advance the cursor over a contiguous prefix of finished chunks
+            completed.add(index)
+            while next_chunk in completed:
+                self.pharos_monitor.last_checked_block = chunks[next_chunk][1]
+                next_chunk += 1
+            await self.tracked_buffer.flush(self.pharos_monitor.last_checked_block)
+        
+        results = await asyncio.gather(
+            *(scan_chunk(i, first, last) for i, (first, last) in enumerate(chunks)),
+            return_exceptions=True
+        )
+        failed = [r for r in results if isinstance(r, Exception)]
+        if failed:
+            # Later chunks are re-scanned by the live loop; tracked_transactions dedupes them
+            logger.error("Backfill stopped at block %s: %s", self.pharos_monitor.last_checked_block, failed[0])
+        else:
+            logger.info("✅ Backfill complete up to block %s", end_block)
+    
+    async def scan_with_leases(self):
+        """Scanner worker loop: claim block-range leases and scan them (BOT_ROLE=scanner).
+        
+        Leases expire after LEASE_TTL unless lease_heartbeat renews them, so a
+        range held by a dead worker is scanned again by another one;
+        tracked_transactions dedupes the overlap.
+        """
+        logger.info("🔄 Starting lease scanner %s...", WORKER_ID)
+        backoff = Backoff()
+        
+        while True:
+            try:
+                if not self.pharos_monitor.monitored_addresses:
+                    await self.pharos_monitor.wait_for_addresses()
+                    continue
+                
+                latest_block = await self.pharos_monitor.get_latest_block()
+                if latest_block <= 0:
+                    # get_latest_block fell back to a cursor that was never set
+                    raise RuntimeError("chain head unavailable")
+                lease = await self.db.claim_lease(WORKER_ID, latest_block)
+                if lease is None:
+                    await self.pharos_monitor.wait_for_new_head()  # All ranges up to head are taken
+                    continue
+                
+                start_block, end_block = lease
+                logger.debug("Checking leased blocks %s to %s", start_block, end_block)
+                self.active_lease = start_block
+                try:
+                    async with aclosing(self.pharos_monitor.scan_range(start_block, end_block)) as blocks:
+                        async for block_num, transactions in blocks:
+                            await self.process_block_matches(block_num, transactions)
+                            self.pharos_monitor.last_checked_block = max(self.pharos_monitor.last_checked_block, block_num)
+                    
+                    # Rows and lease completion are committed together
+                    await self.tracked_buffer.flush(completed_lease=(start_block, end_block, WORKER_ID))
+                finally:
+                    self.active_lease = None
+                backoff.reset()
+                
+            except Exception as e:
+                logger.error("Error in lease scanner: %s", e)
+                await backoff.sleep()
+    
+    async def lease_heartbeat(self):
+        """Renew the lease being scanned and split the notification rate limits between live scanners.
+        
+        Every scanner has its own dispatcher, so each one sends at most
+        1/N of NOTIFY_GLOBAL_RATE and NOTIFY_CHAT_RATE for N live workers.
+        """
+        workers = 1
+        while True:
+            try:
+                lease_start = self.active_lease
+                count, held = await self.db.heartbeat(WORKER_ID, lease_start)
+                if not held:
+                    logger.warning("Lease at block %s expired before it was renewed, another worker may scan it too", lease_start)
+                if count != workers:
+                    workers = count
+                    self.dispatcher.set_share(workers)
+                    logger.info("%s scanner workers live, sending up to %.1f notifications/s", workers, NOTIFY_GLOBAL_RATE / workers)
+            except Exception as e:
+                logger.error("Error renewing lease: %s", e)
+            await asyncio.sleep(LEASE_HEARTBEAT)
+    
+    async def refresh_monitored_addresses(self):
+        """Reload the address index when another process changes the monitored wallets"""
+        version = await self.db.get_index_version()
+        while True:
+            await asyncio.sleep(INDEX_REFRESH_INTERVAL)
+            try:
+                current = await self.db.get_index_version()
+                if current != version:
+                    version = current
+                    await self.load_monitored_addresses()
+                    logger.info("📡 Reloaded %s monitored addresses", len(self.pharos_monitor.monitored_addresses))
+            except Exception as e:
+                logger.error("Error refreshing monitored addresses: %s", e)
     
     async def monitor_transactions(self):
         """Main monitoring loop"""
         logger.info("🔄 Starting transaction monitoring...")
         
+        # Resume from the saved cursor, scanning a large gap in parallel first
+        latest_block = await self.pharos_monitor.get_latest_block()
+        if (self.pharos_monitor.monitored_addresses
+                and latest_block - self.pharos_monitor.last_checked_block > BACKFILL_CHUNK_SIZE):
+            await self.backfill(self.pharos_monitor.last_checked_block + 1, latest_block)
+        
+        backoff = Backoff()
         while True:
             try:
                 if not self.pharos_monitor.monitored_addresses:
-                    await asyncio.sleep(10)  # Wait if no addresses to monitor
+                    # No head polling at all while idle; /register wakes the loop
+                    logger.info("💤 No monitored addresses, scanning paused until one is registered")
+                    await self.pharos_monitor.wait_for_addresses()
+                    # Nothing was watched meanwhile, so the skipped blocks cannot hold matches
+                    latest_block = await self.pharos_monitor.get_latest_block()
+                    self.pharos_monitor.last_checked_block = max(self.pharos_monitor.last_checked_block, latest_block - 1)
                     continue
                 
                 latest_block = await self.pharos_monitor.get_latest_block()
                 
                 if latest_block > self.pharos_monitor.last_checked_block:
-                    logger.info(f"Checking blocks {self.pharos_monitor.last_checked_block + 1} to {latest_block}")
-                    
-                    # Check new blocks (limit to 10 blocks at once to avoid overload)
+                    # Catch up in bounded passes so the head is re-read regularly
                     start_block = self.pharos_monitor.last_checked_block + 1
-                    end_block = min(latest_block + 1, start_block + 10)
+                    end_block = min(latest_block, start_block + SCAN_MAX_BLOCKS - 1)
+                    logger.debug("Checking blocks %s to %s", start_block, end_block)
                     
-                    for block_num in range(start_block, end_block):
-                        transactions = await self.pharos_monitor.check_transactions_in_block(block_num)
-                        
-                        for tx in transactions:
-                            await self.send_transaction_notification(tx['user_id'], tx)
-                            
-                            # Store transaction in database
-                            try:
-                                conn = sqlite3.connect('pharos_bot.db')
-                                cursor = conn.cursor()
-                                cursor.execute(
-                                    'INSERT OR IGNORE INTO tracked_transactions (tx_hash, user_id, block_number) VALUES (?, ?, ?)',
-                                    (tx['tx_hash'], tx['user_id'], tx['block_number'])
-                                )
-                                conn.commit()
-                                conn.close()
-                            except Exception as db_error:
-                                logger.error(f"Database error: {db_error}")
+                    try:
+                        async with aclosing(self.pharos_monitor.scan_range(start_block, end_block)) as blocks:
+                            async for block_num, transactions in blocks:
+                                await self.process_block_matches(block_num, transactions)
+                                self.pharos_monitor.last_checked_block = block_num
+                    finally:
+                        if self.pharos_monitor.last_checked_block >= start_block:
+                            await self.tracked_buffer.flush(self.pharos_monitor.last_checked_block)
                     
-                    self.pharos_monitor.last_checked_block = end_block - 1
+                    backoff.reset()
+                    if self.pharos_monitor.last_checked_block < latest_block:
+                        continue  # Still behind head, keep catching up without sleeping
                 
-                await asyncio.sleep(5)  # Check every 5 seconds
+                await self.pharos_monitor.wait_for_new_head()
                 
             except Exception as e:
-                logger.error(f"Error in monitoring loop: {e}")
-                await asyncio.sleep(10)  # Wait longer on error
+                logger.error("Error in monitoring loop: %s", e)
+                await backoff.sleep()
     
     async def run(self):
         """Run the bot"""
@@ -558,50 +3150,114 @@ class TelegramBot:
             logger.error("Go to Tools > Secrets and add BOT_TOKEN with your bot token value")
             return
         
-        # Test Web3 connection
-        try:
-            if self.pharos_monitor.w3.is_connected():
-                logger.info("✅ Successfully connected to Pharos Testnet")
-                latest_block = await self.pharos_monitor.get_latest_block()
-                logger.info(f"Current block: {latest_block}")
-                self.pharos_monitor.last_checked_block = max(0, latest_block - 1)  # Start from previous block
-            else:
-                logger.error("❌ Failed to connect to Pharos Testnet")
-                return
-        except Exception as e:
-            logger.error(f"Error testing Web3 connection: {e}")
+        if BOT_ROLE not in ("all", "telegram", "scanner"):
+            logger.error("❌ Unknown BOT_ROLE '%s', expected all, telegram or scanner", BOT_ROLE)
             return
-        
-        # Initialize database
-        init_database()
-        
-        # Load existing monitored addresses
-        self.load_monitored_addresses()
+        scanning = BOT_ROLE in ("all", "scanner")
+        polling = BOT_ROLE in ("all", "telegram")
         
         # Create application
-        self.application = Application.builder().token(BOT_TOKEN).build()
+        builder = Application.builder().token(BOT_TOKEN)
+        if TELEGRAM_API_URL:
+            builder = builder.base_url(TELEGRAM_API_URL)
+        self.application = builder.build()
         
         # Add handlers
-        self.application.add_handler(CommandHandler("start", self.start_command))
-        self.application.add_handler(CommandHandler("register", self.register_command))
-        self.application.add_handler(CommandHandler("forceregister", self.force_register_command))
-        self.application.add_handler(CommandHandler("status", self.status_command))
-        self.application.add_handler(CommandHandler("unregister", self.unregister_command))
-        self.application.add_handler(CommandHandler("help", self.help_command))
-        
-        # Start bot
-        await self.application.initialize()
-        await self.application.start()
+        if polling:
+            self.application.add_handler(CommandHandler("start", self.timed_command("start", self.start_command)))
+            self.application.add_handler(CommandHandler("register", self.timed_command("register", self.register_command)))
+            self.application.add_handler(CommandHandler("forceregister", self.timed_command("forceregister", self.force_register_command)))
+            self.application.add_handler(CommandHandler("status", self.timed_command("status", self.status_command)))
+            self.application.add_handler(CommandHandler("unregister", self.timed_command("unregister", self.unregister_command)))
+            self.application.add_handler(CommandHandler("history", self.timed_command("history", self.history_command)))
+            self.application.add_handler(CallbackQueryHandler(
+                self.timed_command("history_page", self.history_page_callback), pattern=r'^history:'
+            ))
+            self.application.add_handler(CommandHandler("help", self.timed_command("help", self.help_command)))
+            # Needs the bot to be an admin of the group to receive member updates
+            self.application.add_handler(ChatMemberHandler(self.chat_member_update, ChatMemberHandler.CHAT_MEMBER))
+        
+        async def prepare_database() -> Optional[int]:
+            """Create the schema, load monitored addresses and group members, return the saved cursor"""
+            await self.db.init_schema()
+            await self.load_monitored_addresses()
+            self.membership.warm(await self.db.load_group_members())
+            return await self.db.load_scan_cursor()
+        
+        async def probe_node() -> Optional[int]:
+            """Connect to the node pool and return the head, or None if no node answers"""
+            if not await self.pharos_monitor.connect():
+                return None
+            logger.info("✅ Successfully connected to Pharos Testnet")
+            latest_block = await self.pharos_monitor.get_latest_block()
+            logger.info("Current block: %s", latest_block)
+            return latest_block
+        
+        # Independent startup steps overlap: database and address index, Telegram getMe, node probe
+        steps = [prepare_database(), self.application.initialize()]
+        if scanning:
+            steps.append(probe_node())  # The telegram role never talks to the node
+        saved_block, initialized, *probe = await asyncio.gather(*steps, return_exceptions=True)
+        for result in (saved_block, initialized):
+            if isinstance(result, BaseException):
+                await self.pharos_monitor.close()
+                raise result
+        
+        if scanning:
+            latest_block = probe[0]
+            if isinstance(latest_block, BaseException):
+                logger.error("Error testing Web3 connection: %s", latest_block)
+            elif latest_block is None:
+                logger.error("❌ Failed to connect to Pharos Testnet")
+            if latest_block is None or isinstance(latest_block, BaseException):
+                await self.application.shutdown()
+                await self.pharos_monitor.close()
+                return
+            
+            if BOT_ROLE == "scanner":
+                pass  # Scanner workers take their position from block-range leases
+            elif saved_block is None:
+                self.pharos_monitor.last_checked_block = max(0, latest_block - 1)  # Start from previous block
+            elif latest_block - saved_block > BACKFILL_MAX_BLOCKS:
+                logger.warning("Saved cursor %s is more than %s blocks behind, skipping the older gap", saved_block, BACKFILL_MAX_BLOCKS)
+                self.pharos_monitor.last_checked_block = latest_block - BACKFILL_MAX_BLOCKS
+            else:
+                logger.info("Resuming from saved block %s", saved_block)
+                self.pharos_monitor.last_checked_block = saved_block
         
-        # Start monitoring in background
-        asyncio.create_task(self.monitor_transactions())
+        # Start notification delivery and monitoring in background
+        scan_tasks = []
+        if scanning:
+            self.dispatcher.start()
+            self.pharos_monitor.start_head_subscription()
+            self.pharos_monitor.start_health_checks()
+        if BOT_ROLE == "all":
+            scan_tasks.append(asyncio.create_task(self.monitor_transactions()))
+            if PENDING_WATCH and PENDING_SOURCE != "txpool" and not WS_URL:
+                logger.warning("PENDING_WATCH with PENDING_SOURCE=subscribe needs WS_URL, pending alerts disabled")
+            elif PENDING_WATCH:
+                scan_tasks.append(asyncio.create_task(PendingWatcher(self.pharos_monitor, self.on_pending_transactions).run()))
+        elif BOT_ROLE == "scanner":
+            scan_tasks.append(asyncio.create_task(self.refresh_monitored_addresses()))
+            scan_tasks.append(asyncio.create_task(self.lease_heartbeat()))
+            scan_tasks.append(asyncio.create_task(self.scan_with_leases()))
+        if PENDING_WATCH and BOT_ROLE != "all":
+            # Confirmations must be seen by the process that sent the alert
+            logger.warning("PENDING_WATCH needs BOT_ROLE=all, pending alerts disabled")
         
-        # Start polling
-        await self.application.updater.start_polling()
+        # Scanning already runs while the updater and handlers start
+        await self.application.start()
+        
+        # Receive updates (only one process may own getUpdates or the webhook)
+        webhook_runner = None
+        if polling and WEBHOOK_URL:
+            webhook_runner = await self.start_webhook()
+        elif polling:
+            await self.application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
         
-        logger.info("🤖 Bot started successfully!")
-        logger.info(f"📡 Monitoring {len(self.pharos_monitor.monitored_addresses)} addresses")
-        logger.info(f"🔗 Connected to Pharos Testnet (Chain ID: {CHAIN_ID})")
+        logger.info("🤖 Bot started successfully! (role: %s)", BOT_ROLE)
+        logger.info("📡 Monitoring %s addresses", len(self.pharos_monitor.monitored_addresses))
+        logger.info("🔗 Connected to Pharos Testnet (Chain ID: %s)", CHAIN_ID)
         
         # Keep running
         try:
@@ -609,8 +3265,30 @@ class TelegramBot:
         except KeyboardInterrupt:
             logger.info("Bot stopped by user")
         finally:
+            # Stop scanning before delivery: every match has then been handed to the
+            # dispatcher; the flush below records only the delivered ones and keeps
+            # the cursor below the rest, so they are scanned and sent after a restart
+            for task in scan_tasks:
+                task.cancel()
+            await asyncio.gather(*scan_tasks, return_exceptions=True)
+            if webhook_runner is not None:
+                await webhook_runner.cleanup()
+            await self.dispatcher.stop()
             await self.application.stop()
+            await self.pharos_monitor.close()
+            try:
+                # Scanner workers only own their leases, never the shared cursor
+                await self.tracked_buffer.flush(self.pharos_monitor.last_checked_block if BOT_ROLE == "all" else None)
+                if BOT_ROLE == "scanner":
+                    await self.db.remove_worker(WORKER_ID)  # the others take over its rate share
+            except Exception as db_error:
+                logger.error("Database error while flushing on shutdown: %s", db_error)
+            await self.db.close()
 
 if __name__ == "__main__":
+    # Jalankan server web di thread terpisah (di mode webhook server web berjalan di loop bot)
+    if not WEBHOOK_URL or BOT_ROLE == "scanner":
+        Thread(target=run_web).start()
+    
     bot = TelegramBot()
     asyncio.run(bot.run())